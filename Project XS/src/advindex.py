@@ -0,0 +1,102 @@
+"""Persistent memory mapped index of blink information for a known base state
+
+The file holds a 64 byte header, then one blink flag bit per advance
+and then the low 4 bits of every output, two advances per byte.
+Build one from the project folder with
+    python ./src/advindex.py S0 S1 S2 S3 --length 100000000
+"""
+import struct
+from typing import Iterator
+import numpy as np
+import indexfile
+from indexfile import INDEX_DIR, INDEX_CHUNK
+import kernels
+from xorshift import Xorshift
+
+MAGIC = b"XSADVIDX"
+VERSION = 1
+HEADER = struct.Struct("<8sI4IQQQ")
+HEADER_SIZE = 64
+
+def index_path(state,directory:str=INDEX_DIR)->str:
+    """Path of the index file for a base state"""
+    return indexfile.index_path(state,".xsidx",directory)
+
+def build_index(state,length:int,path:str=None)->"AdvanceIndex":
+    """Write the index of the first length advances of a base state"""
+    if path is None:
+        path = index_path(state)
+    indexfile.make_parent(path)
+    flags_offset = HEADER_SIZE
+    nibbles_offset = flags_offset+(length+7)//8
+    data = np.memmap(path,dtype=np.uint8,mode="w+",shape=(nibbles_offset+(length+1)//2,))
+    data[:HEADER.size] = np.frombuffer(
+        HEADER.pack(MAGIC,VERSION,*state,length,flags_offset,nibbles_offset),dtype=np.uint8)
+
+    rng = Xorshift(*state)
+    start = 0
+    for block in rng.iter_chunks(INDEX_CHUNK,length):
+        flags = np.packbits(kernels.blink_flags(block),bitorder="little")
+        data[flags_offset+start//8:flags_offset+start//8+len(flags)] = flags
+        nibbles = kernels.blink_types(block)
+        if len(nibbles)%2:
+            nibbles = np.append(nibbles,np.uint8(0))
+        data[nibbles_offset+start//2:nibbles_offset+start//2+len(nibbles)//2] = \
+            nibbles[0::2] | nibbles[1::2] << 4
+        start += len(block)
+        print(f"indexed {start}/{length}")
+    data.flush()
+    del data
+    return AdvanceIndex(path)
+
+def find_index(state,directory:str=INDEX_DIR)->"AdvanceIndex":
+    """Open the index of a base state if one has been built"""
+    return indexfile.open_index(AdvanceIndex,index_path(state,directory))
+
+class AdvanceIndex(indexfile.IndexFile):
+    """Read only view of an index file, nothing is copied until a range is decoded"""
+    MAGIC = MAGIC
+    VERSION = VERSION
+    HEADER = HEADER
+    KIND = "advance index"
+
+    def __init__(self,path:str):
+        super().__init__(path)
+        flags_offset, nibbles_offset = self.header
+        self.flag_bytes = self.data[flags_offset:nibbles_offset]
+        self.nibble_bytes = self.data[nibbles_offset:]
+
+    def get_flags(self,length:int,start:int=0)->np.ndarray:
+        """Decode the blink flags of advances [start,start+length)"""
+        first = start//8
+        bits = np.unpackbits(self.flag_bytes[first:(start+length+7)//8],bitorder="little")
+        return bits[start-first*8:start-first*8+length].astype(bool)
+
+    def get_nibbles(self,length:int,start:int=0)->np.ndarray:
+        """Decode the low 4 bits of the outputs at advances [start,start+length)"""
+        first = start//2
+        packed = self.nibble_bytes[first:(start+length+1)//2]
+        nibbles = np.empty(len(packed)*2,dtype=np.uint8)
+        nibbles[0::2] = packed & 0xF
+        nibbles[1::2] = packed >> 4
+        return nibbles[start-first*2:start-first*2+length]
+
+    def iter_flags(self,length:int,start:int=0,chunk_size:int=INDEX_CHUNK)->Iterator[np.ndarray]:
+        """Lazily decode the blink flags of advances [start,start+length) in chunks"""
+        for offset in range(start,start+length,chunk_size):
+            yield self.get_flags(min(chunk_size,start+length-offset),offset)
+
+    def iter_nibbles(self,length:int,start:int=0,chunk_size:int=INDEX_CHUNK)->Iterator[np.ndarray]:
+        """Lazily decode the low 4 bits of the outputs at advances [start,start+length)
+           in chunks"""
+        for offset in range(start,start+length,chunk_size):
+            yield self.get_nibbles(min(chunk_size,start+length-offset),offset)
+
+def main():
+    """Build an index from the command line"""
+    args = indexfile.parse_build_args("Build the advance index of a base state")
+    index = build_index(args.seeds,args.length,args.output)
+    print(f"wrote {index.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Process wide LRU cache of generated Xorshift output blocks"""
+from collections import OrderedDict
+import threading
+from typing import Iterator
+import numpy as np
+from xorshift import Xorshift
+
+CHUNK_SIZE = 1<<20
+DEFAULT_MAX_BYTES = 128<<20
+
+class BlockCache:
+    """Cache of fixed size output blocks keyed by base state and chunk index
+
+    Chunk c of a state holds the outputs at advances [c*chunk_size,(c+1)*chunk_size)
+    from that state. Blocks are read only and the least recently used ones are
+    evicted once the cache holds more than max_bytes
+    """
+    def __init__(self,chunk_size:int=CHUNK_SIZE,max_bytes:int=DEFAULT_MAX_BYTES):
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_chunk(self,state,chunk:int)->np.ndarray:
+        """Get the outputs of one chunk of a base state"""
+        key = (Xorshift(*[int(seed) for seed in state]).to_int(),chunk)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+        rng = Xorshift.from_int(key[0])
+        rng.advance(chunk*self.chunk_size)
+        block = rng.get_next_rand_block(self.chunk_size)
+        block.flags.writeable = False
+        with self._lock:
+            if key not in self._blocks:
+                self._blocks[key] = block
+                self.nbytes += block.nbytes
+                self._evict()
+        return block
+
+    def iter_blocks(self,state,length:int,start:int=0)->Iterator[np.ndarray]:
+        """Lazily get the outputs at advances [start,start+length) of a base state
+           as read only blocks, split on chunk boundaries"""
+        end = start+length
+        while start<end:
+            chunk, offset = divmod(start,self.chunk_size)
+            size = min(self.chunk_size-offset,end-start)
+            yield self.get_chunk(state,chunk)[offset:offset+size]
+            start += size
+
+    def get_range(self,state,length:int,start:int=0)->np.ndarray:
+        """Get the outputs at advances [start,start+length) of a base state as one array"""
+        blocks = list(self.iter_blocks(state,length,start))
+        if len(blocks)==1:
+            return blocks[0]
+        if not blocks:
+            return np.empty(0,dtype=np.uint32)
+        return np.concatenate(blocks)
+
+    def set_max_bytes(self,max_bytes:int):
+        """Change the memory cap, evicting blocks if needed"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """Drop every cached block"""
+        with self._lock:
+            self._blocks.clear()
+            self.nbytes = 0
+
+    def _evict(self):
+        while self.nbytes>self.max_bytes and self._blocks:
+            _, block = self._blocks.popitem(last=False)
+            self.nbytes -= block.nbytes
+
+CACHE = BlockCache()
+
+def iter_blocks(state,length:int,start:int=0)->Iterator[np.ndarray]:
+    """BlockCache.iter_blocks on the process wide cache"""
+    return CACHE.iter_blocks(state,length,start)
+
+def get_range(state,length:int,start:int=0)->np.ndarray:
+    """BlockCache.get_range on the process wide cache"""
+    return CACHE.get_range(state,length,start)
+
+def set_max_bytes(max_bytes:int):
+    """BlockCache.set_max_bytes on the process wide cache"""
+    CACHE.set_max_bytes(max_bytes)
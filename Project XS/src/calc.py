@@ -1,7 +1,17 @@
 """Module for calculating Xorshift state based on observed information"""
 from bisect import bisect
+from functools import lru_cache
 from functools import reduce
+import os
+from typing import Iterable, List, Tuple, Union
 import numpy as np
+from gf2 import GF2Matrix
+
+# T^(2^k) for k in [0,64] is stored next to this file to skip rebuilding it on startup
+POWER_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),"trans_powers.npy")
+POWER_TABLE_SIZE = 65
+# powers up to this are kept whole since intervals are almost always this short
+SMALL_POWERS = 64
 
 def get_zero(size=32):
     """Get a matrix of the size provided filled with zeros"""
@@ -26,19 +36,117 @@ def get_trans():
         ])
     return trans
 
-def get_ref_matrix(intervals,rows = 39):
+@lru_cache(maxsize=None)
+def get_trans_matrix()->GF2Matrix:
+    """Bit packed transformation matrix used for Xorshift state calculation"""
+    return GF2Matrix.from_array(get_trans())
+
+@lru_cache(maxsize=None)
+def get_power_table()->List[GF2Matrix]:
+    """T^(2^k) for k in [0,64], read from the .npy sidecar when present
+       and written to it when it is not"""
+    try:
+        packed = np.load(POWER_TABLE_PATH)
+        table = [GF2Matrix.from_packed(power,128) for power in packed]
+        if len(table)==POWER_TABLE_SIZE and table[0]==get_trans_matrix():
+            return table
+    except (OSError,ValueError):
+        pass
+    table = [get_trans_matrix()]
+    for _ in range(POWER_TABLE_SIZE-1):
+        table.append(table[-1]@table[-1])
+    try:
+        np.save(POWER_TABLE_PATH,np.stack([power.to_packed() for power in table]))
+    except OSError:
+        pass
+    return table
+
+def get_trans_power_of_two(k:int)->GF2Matrix:
+    """T^(2^k), extending the table past the sidecar when needed"""
+    table = get_power_table()
+    while len(table)<=k:
+        table.append(table[-1]@table[-1])
+    return table[k]
+
+@lru_cache(maxsize=None)
+def get_trans_power(power:int)->GF2Matrix:
+    """Bit packed power of the transformation matrix, small powers are reused across solves"""
+    if power==0:
+        return GF2Matrix.identity(128)
+    if power<=SMALL_POWERS:
+        return get_trans_power(power-1)@get_trans_matrix()
+    return advance_rows(GF2Matrix.identity(128),power)
+
+def advance_rows(mat:GF2Matrix,power:int)->GF2Matrix:
+    """Multiply rows of state observations by T^power, needing O(log power) row products"""
+    if power<=SMALL_POWERS:
+        return mat@get_trans_power(power)
+    k = 0
+    while power:
+        if power&1:
+            mat = mat@get_trans_power_of_two(k)
+        power >>= 1
+        k += 1
+    return mat
+
+def get_trans_rows(power:int,start:int,stop:int)->GF2Matrix:
+    """Rows [start,stop) of T^power"""
+    return advance_rows(GF2Matrix.identity(128)[start:stop],power)
+
+def output_bits(bits:Union[int,Iterable[int]])->List[int]:
+    """Bit positions (0 = lsb) of an output mask or list, highest first"""
+    if isinstance(bits,int):
+        bits = [bit for bit in range(32) if bits>>bit&1]
+    return sorted(set(bits),reverse=True)
+
+def compile_observations(observations:Iterable[Tuple[int,Union[int,Iterable[int]],int]]) \
+        ->Tuple[GF2Matrix,List[int]]:
+    """Compile observations of rng outputs into rows of the state and observed bits
+
+    Each observation is (advance, bits, value): the output of the advance-th
+    next() (1 = the first) has value at the bit positions given by a mask or a
+    list of positions, value holding output bit b in its bit b. Rows are
+    emitted in the order given, highest bit first within an observation
+
+    Returns:
+        ref_matrix:GF2Matrix, observed:List[int]
+    """
+    observations = list(observations)
+    # the output is seed_3, the last 32 columns of the state
+    outputs = {}
+    base,previous = GF2Matrix.identity(128)[96:],0
+    for advance in sorted({observation[0] for observation in observations}):
+        base,previous = advance_rows(base,advance-previous),advance
+        outputs[advance] = base
+    rows = []
+    observed = []
+    for advance,bits,value in observations:
+        for bit in output_bits(bits):
+            rows.append(outputs[advance].rows[31-bit])
+            observed.append(value>>bit&1)
+    return GF2Matrix(rows,128), observed
+
+def solve_observations(observations)->Tuple[int,int,List[int]]:
+    """Solve compiled observations
+
+    Returns:
+        rank:int, particular:int (None when inconsistent), basis:List[int] of the null space
+    """
+    ref_matrix, observed = compile_observations(observations)
+    return ref_matrix.solve(observed)
+
+def reverse_states_by_observations(observations)->list:
+    """Deduce state of Xorshift random number generator from any observed output bits"""
+    return unpack_state(solve_packed(*compile_observations(observations)))
+
+def get_ref_matrix(intervals,rows = 39)->GF2Matrix:
     """Create the matrix to be referenced for Xorshift state calculation based
        on player blink intervals"""
-    intervals = intervals[:rows]
-    base_mat = get_trans()
-    advance_mat = get_trans()
-
-    ref_mat = np.zeros((4*rows,128),"uint8")
-    for i in range(rows):
-        ref_mat[4*i:4*(i+1)] = base_mat[-4:]
-        for _ in range(intervals[i]):
-            base_mat = base_mat@advance_mat%2
-    return ref_mat
+    # the low 4 bits of seed_3 after the first advance
+    advances = [1]
+    for interval in intervals[:rows-1]:
+        advances.append(advances[-1]+interval)
+    return compile_observations((advance,0xF,0) for advance in advances)[0]
 
 def get_ref_matrix_munchlax(intervals):
     """Create the matrix to be referenced for Xorshift state calculation based
@@ -53,64 +161,46 @@ def get_ref_matrix_munchlax(intervals):
                10.1833330651124, 10.545833132167635, 10.745833132167634, 11.108333199222866,
                11.308333199222865, 11.6708332662781, 11.8708332662781, 12.233333333333334
                ]
-    base_mat = get_trans()
-    advance_mat = get_trans()
+    # bits 22-19 of seed_3 after the first advance
+    advance = 1
 
-    ref_mat = np.zeros((144,128),"uint8")
+    advances = []
     safe_intervals = []
-    for i in range(36):
+    for _ in range(36):
         #intervals[-1]を挿入した際のインデックスが奇数だと危険な値の可能性がある
         is_carriable = bisect(section,intervals[-1])%2==1
         while is_carriable:
             #スキップする
-            base_mat = base_mat@advance_mat%2
+            advance += 1
             #危険な値を除外
             intervals.pop()
             is_carriable = bisect(section,intervals[-1])%2==1
-        ref_mat[4*i:4*(i+1)] = base_mat[105:109]
-        base_mat = base_mat@advance_mat%2
+        advances.append(advance)
+        advance += 1
         safe_intervals.append(intervals.pop())
-    return ref_mat, safe_intervals
+    return compile_observations((position,0x780000,0) for position in advances)[0], safe_intervals
+
+def solve_packed(mat,observed:list)->int:
+    """Solve observered information and reference matrix for the state packed
+       into one int, seed_0 in the highest 32 bits"""
+    if not isinstance(mat,GF2Matrix):
+        mat = GF2Matrix.from_array(mat)
+    rank, particular, _ = mat.solve(observed)
+    assert particular is not None, "observations are inconsistent"
+    assert rank==mat.width, f"rank {rank}/{mat.width}, more observations are needed"
+    return particular
+
+def unpack_state(bitvec:int)->list:
+    """Split a packed 128 bit state into [seed_0,seed_1,seed_2,seed_3]"""
+    return [bitvec>>96 & 0xFFFFFFFF, bitvec>>64 & 0xFFFFFFFF,
+            bitvec>>32 & 0xFFFFFFFF, bitvec & 0xFFFFFFFF]
 
 def gauss_jordan(mat,observed:list):
     """Convert observered information and reference matrix to 128 bit Xorshift state
        via gauss jordan elimination"""
-    height,width = mat.shape
-
-    bitmat = [list2bitvec(mat[i]) for i in range(height)]
-
-    res = observed.copy()
-    #forward elimination
-    pivot = 0
-    for i in range(width):
-        isfound = False
-        for j in range(i,height):
-            if isfound:
-                check = 1<<(width-i-1)
-                if bitmat[j]&check==check:
-                    bitmat[j] ^= bitmat[pivot]
-                    res[j] ^= res[pivot]
-            else:
-                check = 1<<(width-i-1)
-                if bitmat[j]&check==check:
-                    isfound = True
-                    bitmat[j],bitmat[pivot] = bitmat[pivot],bitmat[j]
-                    res[j],res[pivot] = res[pivot],res[j]
-        if isfound:
-            pivot += 1
-
-    for i in range(width):
-        check = 1<<(width-i-1)
-        assert bitmat[i]&check>0
-
-    #backward assignment
-    for i in range(1,width)[::-1]:
-        check = 1<<(width-i-1)
-        for j in range(i)[::-1]:
-            if bitmat[j]&check==check:
-                bitmat[j] ^= bitmat[i]
-                res[j] ^= res[i]
-    return res[:width]
+    if not isinstance(mat,GF2Matrix):
+        mat = GF2Matrix.from_array(mat)
+    return bitvec2list(solve_packed(mat,observed),mat.width)
 
 def bitvec2list(bitvec,size=128):
     """Convert bitvec of size to list of bits"""
@@ -131,22 +221,56 @@ def reverse_states(rawblinks:list, intervals:list)->list:
 
     #print(blinks)
     ref_matrix = get_ref_matrix(intervals)
-    lst_result = gauss_jordan(ref_matrix, blinks)
-    bitvec_result = list2bitvec(lst_result)
+    return unpack_state(solve_packed(ref_matrix, blinks))
 
-    result = []
-    for _ in range(4):
-        result.append(bitvec_result&0xFFFFFFFF)
-        bitvec_result>>=32
+def reverse_states_by_types(rawblinks:list, intervals:list, uncertain:list)->list:
+    """Deduce the state for every assignment of types to the uncertain blinks
 
-    result = result[::-1]#reverse order
-    return result
+    The reference matrix only depends on the intervals, so its left inverse is
+    computed once and applied to all 2^len(uncertain) observations together.
+    Assignment h flips uncertain[i] when bit i of h is set, h = 0 is the capture as is
+
+    Returns:
+        List[List[int]]: internal state for each assignment
+    """
+    rows = min(len(rawblinks),len(intervals)+1)
+    left_inverse = get_ref_matrix(intervals,rows).left_inverse()
+    hypotheses = 1<<len(uncertain)
+    everything = (1<<hypotheses)-1
+    # hypothesis h is bit hypotheses-1-h, so bit i of h is clear across the set bits of flips[i]
+    flips = []
+    for i in range(len(uncertain)):
+        run = 1<<i
+        flips.append(everything^(((1<<run)-1)<<run)*(everything//((1<<2*run)-1)))
+    observed = []
+    for index,blink in enumerate(rawblinks[:rows]):
+        packed = everything if blink&1 else 0
+        for i,j in enumerate(uncertain):
+            if j==index:
+                packed ^= flips[i]
+        observed.extend([0,0,0,packed])
+    # column h of the product is the solution for assignment h
+    solutions = (left_inverse@GF2Matrix(observed,hypotheses)).transpose().rows
+    return [unpack_state(bitvec) for bitvec in solutions]
 
 def reverse_float_range(rand_float:float, minimum:float, maximum:float):
     """Convert random float back to original integer"""
     norm_f = (maximum-rand_float)/(maximum-minimum)
     return int(norm_f*8388607.0)&0x7fffff
 
+def munchlax_buckets(interval:float, margin:float=0.1)->Tuple[int,int]:
+    """Plausible values of output bits 22-19 for a munchlax blink interval (delay corrected)
+
+    Bits 22-19 select one of 16 buckets of randrange(r,100,370)/30. Within margin
+    seconds of a bucket boundary both neighbouring buckets are plausible
+
+    Returns:
+        lower:int, upper:int (equal when the interval is safe)
+    """
+    lower, upper = [reverse_float_range(min(max(30.0*f,100),370),100,370)>>19
+                    for f in (interval+margin,interval-margin)]
+    return lower, upper
+
 def reverse_states_by_munchlax(intervals:list)->int:
     """Deduce state of Xorshift random number generator using munchlax blink intervals"""
     ref_matrix, safe_intervals = get_ref_matrix_munchlax(intervals)
@@ -158,11 +282,4 @@ def reverse_states_by_munchlax(intervals:list)->int:
             bits >>= 1
     bitlst_intervals = bitlst_intervals[::-1]
 
-    bitvec_result = list2bitvec(gauss_jordan(ref_matrix, bitlst_intervals))
-    result = []
-    for _ in range(4):
-        result.append(bitvec_result&0xFFFFFFFF)
-        bitvec_result>>=32
-
-    result = result[::-1]#reverse order
-    return result
+    return unpack_state(solve_packed(ref_matrix, bitlst_intervals))
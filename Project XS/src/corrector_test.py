@@ -0,0 +1,54 @@
+from random import randint
+from xorshift import Xorshift
+from solver import BlinkCorrector, BlinkSolver
+
+# amount of blinks in each capture
+blink_len = 40
+# captures simulated for each corrupted interval
+captures = 30
+
+def capture(npc):
+    """Simulate logging blink_len player blinks, returns the rng at the last blink too"""
+    rng = Xorshift(randint(0,0xFFFFFFFF),randint(0,0xFFFFFFFF),
+                   randint(0,0xFFFFFFFF),randint(0,0xFFFFFFFF))
+    blinks = []
+    intervals = [randint(5,30)]
+    last = None
+    advance = 0
+    while len(blinks) < blink_len:
+        rand = rng.next()
+        rng.advance(npc)
+        if rand & 0b1110 == 0:
+            blinks.append(rand & 1)
+            if last is not None:
+                intervals.append(advance - last)
+            last = advance
+        advance += 1
+    # the rng recov hands back is about to produce the last blink
+    rng.rewind(npc+1)
+    return blinks, intervals, rng
+
+# the first and last intervals logged one advance off, the ends of the capture
+# are where a moved blink and a shifted interval can be confused
+wrong = 0
+for index in (1,blink_len-1):
+    for delta in (-1,1):
+        for trial in range(captures):
+            npc = trial % 3
+            blinks, intervals, truth = capture(npc)
+            if intervals[index]+delta < 1:
+                continue
+            intervals[index] += delta
+            solver = BlinkSolver(npc)
+            for blink, interval in zip(blinks,intervals):
+                solver.add_blink(blink,interval)
+            if solver.solved:
+                # the capture is still consistent as logged, nothing to correct
+                continue
+            corrected = BlinkCorrector(blinks,intervals,npc).correct()
+            # several answers are reported as ambiguous, a single one has to be the truth
+            if len(corrected) == 1 and corrected[0][0] != truth:
+                wrong += 1
+                print(f"interval {index} {delta:+}: got {corrected[0][1]}, npc={npc}")
+print(f"{wrong} wrong corrections")
+assert wrong == 0
@@ -0,0 +1,144 @@
+"""Persistent suffix array of blink gaps for a known base state
+
+For every player position among the npcs the blinks of the first length
+advances are listed in order and turned into the gaps between consecutive
+blinks, counted in that position's own advances, with a 0 closing each
+position. A suffix array over the gaps turns reidentifying by intervals
+into a binary search for the observed intervals.
+The file holds a 128 byte header, then the first blink of each position,
+the advance of every blink, the gaps and the suffix array.
+Build one from the project folder with
+    python ./src/gapindex.py S0 S1 S2 S3 --length 100000000 --npc 0
+"""
+import struct
+from typing import List
+import numpy as np
+import indexfile
+from indexfile import INDEX_DIR
+from gramindex import phase_blinks
+
+MAGIC = b"XSGAPIDX"
+VERSION = 1
+HEADER = struct.Struct("<8sI4IQIQ4Q")
+HEADER_SIZE = 128
+MAX_GAP = (1<<16)-1
+
+def index_path(state,npc:int=0,directory:str=INDEX_DIR)->str:
+    """Path of the gap index file for a base state and num of npcs"""
+    return indexfile.index_path(state,f".npc{npc}.xsgap",directory)
+
+def suffix_array(text:np.ndarray)->np.ndarray:
+    """Suffix array of text by prefix doubling, a suffix running off the end sorts first"""
+    size = len(text)
+    if size==0:
+        return np.empty(0,dtype=np.uint32)
+    _,rank = np.unique(text,return_inverse=True)
+    rank = rank.astype(np.int64)
+    length = 1
+    while True:
+        # rank of the suffix length further on, 0 once it runs off the end
+        following = np.zeros(size,dtype=np.int64)
+        following[:size-length] = rank[length:]+1
+        key = rank<<32 | following
+        order = np.argsort(key,kind="stable")
+        key = key[order]
+        rank[order] = np.concatenate(([0],np.cumsum(key[1:]!=key[:-1])))
+        if rank[order[-1]]==size-1 or length>=size:
+            return order.astype(np.uint32)
+        length <<= 1
+
+def build_index(state,length:int,npc:int=0,path:str=None)->"GapIndex":
+    """Write the gap index of the blinks in the first length advances of a base state"""
+    if path is None:
+        path = index_path(state,npc)
+    indexfile.make_parent(path)
+
+    positions,_ = phase_blinks(state,length,npc)
+    phase_starts = np.cumsum([0]+[len(phase) for phase in positions]).astype(np.uint64)
+    # the gap after each blink lines up with the blink, the last one of a position closes it
+    gaps = []
+    for phase in positions:
+        gap = np.zeros(len(phase),dtype=np.uint16)
+        gap[:-1] = np.minimum(np.diff(phase.astype(np.int64))//(npc+1),MAX_GAP)
+        gaps.append(gap)
+    gaps = np.concatenate(gaps)
+    positions = np.concatenate(positions)
+    print(f"sorting {len(gaps)} suffixes")
+    suffixes = suffix_array(gaps)
+
+    indexfile.write_sections(
+        path,HEADER_SIZE,[phase_starts,positions,gaps,suffixes],
+        lambda sections: HEADER.pack(MAGIC,VERSION,*state,length,npc,len(positions),*sections))
+    return GapIndex(path)
+
+def find_index(state,npc:int=0,directory:str=INDEX_DIR)->"GapIndex":
+    """Open the gap index of a base state if one has been built"""
+    return indexfile.open_index(GapIndex,index_path(state,npc,directory))
+
+class GapIndex(indexfile.IndexFile):
+    """Read only view of a gap index file"""
+    MAGIC = MAGIC
+    VERSION = VERSION
+    HEADER = HEADER
+    KIND = "gap index"
+
+    def __init__(self,path:str):
+        super().__init__(path)
+        self.npc, blinks, *sections = self.header
+        position_dtype = indexfile.position_dtype(self.length)
+        self.phase_starts = self.data[sections[0]:sections[0]+(self.npc+2)*8].view(np.uint64)
+        size = blinks*np.dtype(position_dtype).itemsize
+        self.positions = self.data[sections[1]:sections[1]+size].view(position_dtype)
+        self.gaps = self.data[sections[2]:sections[2]+blinks*2].view(np.uint16)
+        self.suffixes = self.data[sections[3]:sections[3]+blinks*4].view(np.uint32)
+
+    def _compare(self,suffix:int,pattern:np.ndarray)->int:
+        """Sign of the suffix starting at gap suffix against pattern, cut to its length"""
+        window = self.gaps[suffix:suffix+len(pattern)]
+        differ = np.flatnonzero(window!=pattern[:len(window)])
+        if len(differ):
+            return 1 if window[differ[0]]>pattern[differ[0]] else -1
+        return -1 if len(window)<len(pattern) else 0
+
+    def _bound(self,pattern:np.ndarray,upper:bool)->int:
+        """First suffix rank that sorts after (upper) or not before pattern"""
+        low,high = 0,len(self.suffixes)
+        while low<high:
+            mid = (low+high)//2
+            sign = self._compare(int(self.suffixes[mid]),pattern)
+            if sign<0 or (upper and sign==0):
+                low = mid+1
+            else:
+                high = mid
+        return low
+
+    def find(self,intervals:List[int],search_min:int=0,search_max:int=None):
+        """Every run of blinks spaced by intervals whose last blink is at an advance
+           in [search_min,search_max), in the order reidentify prefers them
+
+        Returns:
+            advances:np.ndarray of the last blink, distances:np.ndarray of the player position
+        """
+        if search_max is None:
+            search_max = self.length
+        if any(interval<=0 or interval>MAX_GAP for interval in intervals):
+            return np.empty(0,dtype=np.int64),np.empty(0,dtype=np.int64)
+        pattern = np.array(intervals,dtype=np.uint16)
+        # the 0 closing each position keeps matches from running into the next one
+        starts = self.suffixes[self._bound(pattern,False):self._bound(pattern,True)] \
+            .astype(np.int64)
+        distances = np.searchsorted(self.phase_starts.astype(np.int64),starts,side="right")-1
+        advances = self.positions[starts+len(pattern)].astype(np.int64)
+        selected = (search_min<=advances)&(advances<search_max)
+        advances,distances = advances[selected],distances[selected]
+        order = np.lexsort((advances,distances))
+        return advances[order],distances[order]
+
+def main():
+    """Build an index from the command line"""
+    args = indexfile.parse_build_args("Build the blink gap index of a base state",npc=True)
+    index = build_index(args.seeds,args.length,args.npc,path=args.output)
+    print(f"wrote {index.path}")
+
+if __name__ == "__main__":
+    main()
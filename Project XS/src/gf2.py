@@ -0,0 +1,268 @@
+"""Bit packed matrices over GF(2)"""
+from typing import List
+from typing import Tuple
+import numpy as np
+
+def parity(value:int)->int:
+    """Parity of the set bits of value"""
+    return bin(value).count("1")&1
+
+def combine_rows(selector:int,rows:List[int])->int:
+    """XOR together the rows picked by selector, its highest bit picks rows[0]"""
+    result = 0
+    index = len(rows)-1
+    while selector:
+        if selector&1:
+            result ^= rows[index]
+        selector >>= 1
+        index -= 1
+    return result
+
+class GF2Matrix:
+    """Matrix over GF(2) with each row packed into an int, column 0 in the highest bit
+
+    Matches the bit order of calc.list2bitvec so a row packs like a row of the uint8 matrices
+    """
+    __slots__ = ("rows","width")
+
+    def __init__(self,rows:List[int],width:int):
+        self.rows = list(rows)
+        self.width = width
+
+    @classmethod
+    def identity(cls,size:int)->"GF2Matrix":
+        """Identity matrix of size"""
+        return cls([1<<(size-1-i) for i in range(size)],size)
+
+    @classmethod
+    def zeros(cls,height:int,width:int)->"GF2Matrix":
+        """Matrix of height and width filled with zeros"""
+        return cls([0]*height,width)
+
+    @classmethod
+    def from_array(cls,array)->"GF2Matrix":
+        """Pack a 2d array of bits"""
+        array = np.asarray(array,dtype=np.uint8)&1
+        return cls.from_packed(np.packbits(array,axis=1),array.shape[1])
+
+    @classmethod
+    def from_packed(cls,packed:np.ndarray,width:int)->"GF2Matrix":
+        """Unpack the uint8 rows written by to_packed"""
+        # packbits pads on the right, shift the padding back out
+        padding = packed.shape[1]*8-width
+        return cls([int.from_bytes(row.tobytes(),"big")>>padding for row in packed],width)
+
+    @classmethod
+    def vstack(cls,matrices:List["GF2Matrix"])->"GF2Matrix":
+        """Stack matrices of the same width on top of each other"""
+        return cls([row for matrix in matrices for row in matrix.rows],matrices[0].width)
+
+    def to_packed(self)->np.ndarray:
+        """Pack into a 2d uint8 array of bytes like np.packbits along the rows"""
+        size = (self.width+7)//8
+        padding = size*8-self.width
+        return np.frombuffer(b"".join((row<<padding).to_bytes(size,"big") for row in self.rows),
+                             dtype=np.uint8).reshape(self.height,size)
+
+    def to_array(self)->np.ndarray:
+        """Unpack into a 2d uint8 array"""
+        array = np.zeros((self.height,self.width),dtype=np.uint8)
+        for i,row in enumerate(self.rows):
+            array[i] = [(row>>(self.width-1-j))&1 for j in range(self.width)]
+        return array
+
+    @property
+    def height(self)->int:
+        """Number of rows"""
+        return len(self.rows)
+
+    @property
+    def shape(self)->Tuple[int,int]:
+        """(height,width) like numpy"""
+        return self.height,self.width
+
+    def __getitem__(self,index):
+        if isinstance(index,slice):
+            return GF2Matrix(self.rows[index],self.width)
+        return self.rows[index]
+
+    def __eq__(self,other):
+        if not isinstance(other,GF2Matrix):
+            return NotImplemented
+        return self.width==other.width and self.rows==other.rows
+
+    def __matmul__(self,other:"GF2Matrix")->"GF2Matrix":
+        return GF2Matrix([combine_rows(row,other.rows) for row in self.rows],other.width)
+
+    def __pow__(self,exponent:int)->"GF2Matrix":
+        result = GF2Matrix.identity(self.width)
+        square = self
+        while exponent:
+            if exponent&1:
+                result = result@square
+            exponent >>= 1
+            if exponent:
+                square = square@square
+        return result
+
+    def dot(self,vec:int)->int:
+        """Multiply by a packed column vector, row 0 lands in the highest bit"""
+        result = 0
+        for row in self.rows:
+            result = result<<1 | parity(row&vec)
+        return result
+
+    def transpose(self)->"GF2Matrix":
+        """Swap rows and columns"""
+        columns = [0]*self.width
+        for row in self.rows:
+            for j in range(self.width):
+                columns[j] = columns[j]<<1 | (row>>(self.width-1-j))&1
+        return GF2Matrix(columns,self.height)
+
+    def solve(self,rhs:List[int])->Tuple[int,int,List[int]]:
+        """Solve self·x = rhs, the rows and rhs together form the augmented matrix
+
+        Returns:
+            rank:int, particular:int (None when inconsistent), basis:List[int] of the null space
+        """
+        eliminator = GF2Eliminator(self.width)
+        for row,bit in zip(self.rows,rhs):
+            eliminator.add_row(row,bit)
+        if not eliminator.consistent:
+            return eliminator.rank, None, []
+        return (eliminator.rank, *eliminator.solution_space())
+
+    def left_inverse(self)->"GF2Matrix":
+        """Matrix L with L@self = I, so L.dot(rhs) solves every consistent rhs at once
+
+        Raises:
+            ValueError: the columns are not independent
+        """
+        eliminator = GF2Eliminator(self.width)
+        for index,row in enumerate(self.rows):
+            # tag each row with its position so pivots record how they were formed
+            eliminator.add_row(row,1<<(self.height-1-index))
+        if eliminator.rank<self.width:
+            raise ValueError(f"matrix of rank {eliminator.rank}/{self.width} has no left inverse")
+        combinations = {}
+        for top in sorted(eliminator.pivots):
+            row,tag = eliminator.pivots[top]
+            row ^= 1<<top
+            while row:
+                bit = row.bit_length()-1
+                tag ^= combinations[bit]
+                row ^= 1<<bit
+            combinations[top] = tag
+        return GF2Matrix([combinations[self.width-1-j] for j in range(self.width)],self.height)
+
+    def row_reduce(self,rhs:List[int]=None)->Tuple["GF2Matrix",List[int],List[int]]:
+        """Reduce to reduced row echelon form with XOR row operations
+
+        rhs entries get the same row operations, so each may pack several right hand sides
+
+        Returns:
+            matrix:GF2Matrix, rhs:List[int], pivots:List[int] (pivot column of each leading row)
+        """
+        rows = list(self.rows)
+        res = list(rhs) if rhs is not None else [0]*len(rows)
+        pivots = []
+        pivot = 0
+        for column in range(self.width):
+            check = 1<<(self.width-column-1)
+            for j in range(pivot,len(rows)):
+                if rows[j]&check:
+                    break
+            else:
+                continue
+            rows[j],rows[pivot] = rows[pivot],rows[j]
+            res[j],res[pivot] = res[pivot],res[j]
+            pivot_row = rows[pivot]
+            pivot_res = res[pivot]
+            for j,row in enumerate(rows):
+                if j!=pivot and row&check:
+                    rows[j] = row^pivot_row
+                    res[j] ^= pivot_res
+            pivots.append(column)
+            pivot += 1
+            if pivot==len(rows):
+                break
+        return GF2Matrix(rows,self.width), res, pivots
+
+class GF2Eliminator:
+    """Gaussian elimination over GF(2) that takes one row at a time
+
+    Every kept row has a distinct highest set bit (its pivot),
+    so a new row is reduced with at most width XORs. The rhs ints may pack
+    several right hand sides, one per bit, as long as only particular()
+    is used to solve them
+    """
+    def __init__(self,width:int):
+        self.width = width
+        self.pivots = {}
+        self.consistent = True
+
+    def copy(self)->"GF2Eliminator":
+        """Independent copy to continue the elimination from"""
+        eliminator = GF2Eliminator(self.width)
+        eliminator.pivots = dict(self.pivots)
+        eliminator.consistent = self.consistent
+        return eliminator
+
+    @property
+    def rank(self)->int:
+        """Number of independent rows seen so far"""
+        return len(self.pivots)
+
+    def reduce(self,row:int,rhs:int=0)->Tuple[int,int]:
+        """Reduce the equation row·x = rhs by the kept rows until its highest bit is a new pivot"""
+        while row:
+            top = row.bit_length()-1
+            if top not in self.pivots:
+                break
+            pivot_row,pivot_rhs = self.pivots[top]
+            row ^= pivot_row
+            rhs ^= pivot_rhs
+        return row,rhs
+
+    def add_row(self,row:int,rhs:int=0)->bool:
+        """Add the equation row·x = rhs, returns whether it raised the rank"""
+        row,rhs = self.reduce(row,rhs)
+        if row:
+            self.pivots[row.bit_length()-1] = (row,rhs)
+            return True
+        if rhs:
+            # 0 = 1, the rows seen so far have no common solution
+            self.consistent = False
+        return False
+
+    def solve(self)->int:
+        """Packed solution of a full rank consistent system, column 0 in the highest bit"""
+        if self.rank<self.width or not self.consistent:
+            raise ValueError(f"system of rank {self.rank}/{self.width} "
+                             f"{'is' if self.consistent else 'is not'} consistent, cannot solve")
+        return self.particular()
+
+    def particular(self,rhs_bit:int=0)->int:
+        """Solution with every free bit zero for the right hand side in bit rhs_bit of the rhs"""
+        return self._back_substitute(0,rhs_bit)
+
+    def solution_space(self)->Tuple[int,List[int]]:
+        """Every solution of a consistent system as a particular solution
+           XOR any combination of the null space basis
+
+        Returns:
+            particular:int, basis:List[int]
+        """
+        if not self.consistent:
+            raise ValueError("system is not consistent, it has no solutions")
+        free = [bit for bit in range(self.width) if bit not in self.pivots]
+        return self.particular(), [self._back_substitute(1<<bit,None) for bit in free]
+
+    def _back_substitute(self,solution:int,rhs_bit:int=None)->int:
+        # a pivot row only touches bits below its pivot, which are already solved
+        for top in sorted(self.pivots):
+            row,rhs = self.pivots[top]
+            rhs = 0 if rhs_bit is None else rhs>>rhs_bit&1
+            solution |= (rhs^parity(row&solution))<<top
+        return solution
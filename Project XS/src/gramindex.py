@@ -0,0 +1,177 @@
+"""Persistent inverted index of blink type k-grams for a known base state
+
+For every player position among the npcs the blinks of the first length
+advances are listed in order, and every run of k consecutive blink types
+(a k-gram, read as a k bit number) points back to where it starts.
+The file holds a 128 byte header, then the first blink of each position,
+the start of each k-gram's postings, the advance of every blink, the blink
+types as bits and the postings themselves.
+Build one from the project folder with
+    python ./src/gramindex.py S0 S1 S2 S3 --length 100000000 --npc 0
+"""
+import struct
+from typing import List
+import numpy as np
+import indexfile
+from indexfile import INDEX_DIR, INDEX_CHUNK
+import kernels
+from xorshift import Xorshift
+
+MAGIC = b"XSGRAMIX"
+VERSION = 1
+HEADER = struct.Struct("<8sI4IQIIQ5Q")
+HEADER_SIZE = 128
+GRAM_BITS = 16
+
+def index_path(state,npc:int=0,directory:str=INDEX_DIR)->str:
+    """Path of the k-gram index file for a base state and num of npcs"""
+    return indexfile.index_path(state,f".npc{npc}.xsgram",directory)
+
+def phase_blinks(state,length:int,npc:int=0):
+    """Advances and types of the blinks in the first length advances of a base state,
+       split by the player position among the npcs they land on
+
+    Returns:
+        positions:List[np.ndarray], types:List[np.ndarray] one per player position
+    """
+    positions = [[] for _ in range(npc+1)]
+    types = [[] for _ in range(npc+1)]
+    start = 0
+    for block in Xorshift(*state).iter_chunks(INDEX_CHUNK,length):
+        blinks = np.flatnonzero(kernels.blink_flags(block))
+        phase = (blinks+start)%(npc+1)
+        for distance in range(npc+1):
+            selected = blinks[phase==distance]
+            positions[distance].append((selected+start).astype(indexfile.position_dtype(length)))
+            types[distance].append(kernels.blink_types(block[selected]))
+        start += len(block)
+        print(f"read {start}/{length}")
+    positions = [np.concatenate(phase) for phase in positions]
+    types = [np.concatenate(phase) for phase in types]
+    return positions,types
+
+def build_index(state,length:int,npc:int=0,gram_bits:int=GRAM_BITS,path:str=None)->"GramIndex":
+    """Write the k-gram index of the blinks in the first length advances of a base state"""
+    if path is None:
+        path = index_path(state,npc)
+    indexfile.make_parent(path)
+
+    positions,types = phase_blinks(state,length,npc)
+    phase_starts = np.cumsum([0]+[len(phase) for phase in positions]).astype(np.uint64)
+
+    # k-grams never straddle two player positions
+    ordinals = []
+    keys = []
+    for distance,phase in enumerate(types):
+        grams = max(len(phase)-gram_bits+1,0)
+        key = np.zeros(grams,dtype=np.int64)
+        for offset in range(gram_bits):
+            key = key<<1 | phase[offset:offset+grams]
+        keys.append(key)
+        ordinals.append(np.arange(grams,dtype=np.int64)+int(phase_starts[distance]))
+    keys = np.concatenate(keys)
+    ordinals = np.concatenate(ordinals)
+    order = np.argsort(keys,kind="stable")
+    postings = ordinals[order].astype(np.uint32)
+    offsets = np.zeros((1<<gram_bits)+1,dtype=np.uint64)
+    offsets[1:] = np.cumsum(np.bincount(keys,minlength=1<<gram_bits))
+
+    positions = np.concatenate(positions)
+    packed_types = np.packbits(np.concatenate(types),bitorder="little")
+    indexfile.write_sections(
+        path,HEADER_SIZE,[phase_starts,offsets,positions,packed_types,postings],
+        lambda sections: HEADER.pack(MAGIC,VERSION,*state,length,npc,gram_bits,
+                                     len(positions),*sections))
+    return GramIndex(path)
+
+def find_index(state,npc:int=0,directory:str=INDEX_DIR)->"GramIndex":
+    """Open the k-gram index of a base state if one has been built"""
+    return indexfile.open_index(GramIndex,index_path(state,npc,directory))
+
+class GramIndex(indexfile.IndexFile):
+    """Read only view of a k-gram index file, postings are read as they are looked up"""
+    MAGIC = MAGIC
+    VERSION = VERSION
+    HEADER = HEADER
+    KIND = "k-gram index"
+
+    def __init__(self,path:str):
+        super().__init__(path)
+        self.npc, self.gram_bits, blinks, *sections = self.header
+        position_dtype = indexfile.position_dtype(self.length)
+        self.phase_starts = self.data[sections[0]:sections[0]+(self.npc+2)*8].view(np.uint64)
+        self.offsets = self.data[sections[1]:sections[1]+((1<<self.gram_bits)+1)*8].view(np.uint64)
+        size = blinks*np.dtype(position_dtype).itemsize
+        self.positions = self.data[sections[2]:sections[2]+size].view(position_dtype)
+        self.type_bytes = self.data[sections[3]:sections[3]+(blinks+7)//8]
+        self.postings = self.data[sections[4]:].view(np.uint32)[:int(self.offsets[-1])]
+
+    def get_types(self,ordinals:np.ndarray)->np.ndarray:
+        """Blink types of the given blink ordinals"""
+        return self.type_bytes[ordinals>>3]>>(ordinals&7)&1
+
+    def _postings(self,low:int,high:int)->np.ndarray:
+        return self.postings[int(self.offsets[low]):int(self.offsets[high])].astype(np.int64)
+
+    def _candidates(self,pattern:List[int])->np.ndarray:
+        """Blink ordinals where pattern may start"""
+        if len(pattern)<self.gram_bits:
+            # every k-gram starting with the pattern, and the starts too close to the end for one
+            key = int("".join(map(str,pattern)),2)<<(self.gram_bits-len(pattern))
+            starts = [np.sort(self._postings(key,key+(1<<(self.gram_bits-len(pattern)))))]
+            for end in self.phase_starts[1:].astype(np.int64):
+                starts.append(np.arange(max(end-self.gram_bits+1,0),end-len(pattern)+1))
+            return np.unique(np.concatenate(starts))
+        grams = sorted({*range(0,len(pattern)-self.gram_bits+1,self.gram_bits),
+                        len(pattern)-self.gram_bits},
+                       key=lambda offset: self._gram_count(pattern,offset))
+        starts = None
+        for offset in grams:
+            key = int("".join(map(str,pattern[offset:offset+self.gram_bits])),2)
+            found = self._postings(key,key+1)-offset
+            starts = found if starts is None else np.intersect1d(starts,found,assume_unique=True)
+            if not len(starts):
+                break
+        return starts
+
+    def _gram_count(self,pattern:List[int],offset:int)->int:
+        key = int("".join(map(str,pattern[offset:offset+self.gram_bits])),2)
+        return int(self.offsets[key+1]-self.offsets[key])
+
+    def find(self,pattern:List[int],search_min:int=0,search_max:int=None):
+        """Every match of the blink types in pattern whose last blink is at an advance
+           in [search_min,search_max), in the order reidentify prefers them
+
+        Returns:
+            advances:np.ndarray of the last blink, distances:np.ndarray of the player position
+        """
+        if search_max is None:
+            search_max = self.length
+        starts = self._candidates(pattern)
+        starts = starts[starts>=0]
+        # a match may not run into the next player position
+        distances = np.searchsorted(self.phase_starts.astype(np.int64),starts,side="right")-1
+        starts,distances = self._verify(pattern,starts,distances)
+        advances = self.positions[starts+len(pattern)-1].astype(np.int64)
+        selected = (search_min<=advances)&(advances<search_max)
+        advances,distances = advances[selected],distances[selected]
+        order = np.lexsort((advances,distances))
+        return advances[order],distances[order]
+
+    def _verify(self,pattern:List[int],starts:np.ndarray,distances:np.ndarray):
+        ends = self.phase_starts[1:].astype(np.int64)
+        inside = starts+len(pattern)<=ends[distances]
+        starts,distances = starts[inside],distances[inside]
+        matched = np.ones(len(starts),dtype=bool)
+        for offset,blink in enumerate(pattern):
+            matched &= self.get_types(starts+offset)==blink
+        return starts[matched],distances[matched]
+
+def main():
+    """Build an index from the command line"""
+    args = indexfile.parse_build_args("Build the blink k-gram index of a base state",npc=True)
+    index = build_index(args.seeds,args.length,args.npc,path=args.output)
+    print(f"wrote {index.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Shared layout of the memory mapped index files of a known base state
+
+Every index starts with a header holding its magic, version, S[0-3] and the
+number of advances it covers, and lives in INDEX_DIR under the name of its state
+"""
+import argparse
+import os
+from typing import Callable, List
+import numpy as np
+
+INDEX_DIR = "./indexes"
+# multiple of 8 so every chunk fills whole flag bytes
+INDEX_CHUNK = 1<<20
+
+def index_path(state,suffix:str,directory:str=INDEX_DIR)->str:
+    """Path of an index file for a base state, suffix tells the kinds of index apart"""
+    return os.path.join(directory,"".join(f"{int(seed):08X}" for seed in state)+suffix)
+
+def open_index(index_class,path:str):
+    """Open the index at path if one has been built"""
+    if not os.path.exists(path):
+        return None
+    return index_class(path)
+
+def make_parent(path:str):
+    """Create the folder an index is about to be written to"""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+
+def position_dtype(length:int):
+    """Smallest dtype holding every advance below length"""
+    return np.uint32 if length<=1<<32 else np.uint64
+
+def align(offset:int)->int:
+    """Round a file offset up so any array can be viewed from it"""
+    return (offset+7)//8*8
+
+def write_sections(path:str,header_size:int,arrays:List[np.ndarray],
+                   pack_header:Callable[[List[int]],bytes]):
+    """Write a header followed by 8 byte aligned arrays, pack_header gets the file
+       offset of each array so the header can point at them"""
+    sections = []
+    offset = header_size
+    for array in arrays:
+        sections.append(offset)
+        offset = align(offset+array.nbytes)
+    data = np.memmap(path,dtype=np.uint8,mode="w+",shape=(offset,))
+    header = pack_header(sections)
+    data[:len(header)] = np.frombuffer(header,dtype=np.uint8)
+    for section,array in zip(sections,arrays):
+        data[section:section+array.nbytes] = np.frombuffer(array.tobytes(),dtype=np.uint8)
+    data.flush()
+    del data
+
+class IndexFile:
+    """Read only view of an index file, checks the header every index starts with
+
+    Subclasses set MAGIC, VERSION, HEADER (magic, version, S[0-3], length, ...)
+    and KIND, the rest of the header is left in self.header
+    """
+    MAGIC = None
+    VERSION = None
+    HEADER = None
+    KIND = "index"
+
+    def __init__(self,path:str):
+        self.path = path
+        self.data = np.memmap(path,dtype=np.uint8,mode="r")
+        magic,version,*header = self.HEADER.unpack(self.data[:self.HEADER.size].tobytes())
+        if magic!=self.MAGIC or version!=self.VERSION:
+            raise ValueError(f"{path} is not a version {self.VERSION} {self.KIND}")
+        self.state = header[:4]
+        self.length = header[4]
+        self.header = header[5:]
+
+    def covers(self,state,length:int)->bool:
+        """Whether this index holds the first length advances of state"""
+        return list(self.state)==[int(seed) for seed in state] and length<=self.length
+
+def parse_build_args(description:str,npc:bool=False)->argparse.Namespace:
+    """Command line arguments of the index builders"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("seeds",nargs=4,type=lambda seed: int(seed,16),
+                        help="S[0-3] of the base state in hex")
+    parser.add_argument("--length",type=int,default=10**8,help="advances to index")
+    if npc:
+        parser.add_argument("--npc",type=int,default=0,help="num of npcs while reidentifying")
+    parser.add_argument("--output",default=None,help=f"index file, defaults to {INDEX_DIR}/")
+    return parser.parse_args()
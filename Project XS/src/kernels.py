@@ -0,0 +1,38 @@
+"""Vectorized kernels for values derived from arrays of Xorshift outputs"""
+import numpy as np
+
+def blink_flags(rands:np.ndarray)->np.ndarray:
+    """Whether each random number makes the player blink"""
+    return rands & 0b1110 == 0
+
+def blink_types(rands:np.ndarray)->np.ndarray:
+    """Blink type of each random number (0 = single, 1 = double when it blinks)"""
+    return (rands & 0xF).astype(np.uint8)
+
+def randfloat(rands:np.ndarray)->np.ndarray:
+    """Convert random numbers to floats in range [0,1] like Xorshift.randfloat"""
+    return (rands & 0x7fffff) / 8388607.0
+
+def rangefloat(rands:np.ndarray,minimum:float,maximum:float)->np.ndarray:
+    """Convert random numbers to floats in range [minimum,maximum]
+       like Xorshift.rangefloat and rngtool.randrange"""
+    temp = randfloat(rands)
+    return temp * minimum + (1-temp) * maximum
+
+def pokemon_intervals(rands:np.ndarray)->np.ndarray:
+    """Seconds until the next pokemon blink, rangefloat(3,12)+0.285"""
+    return rangefloat(rands,3,12) + 0.285
+
+def munchlax_intervals(rands:np.ndarray)->np.ndarray:
+    """Seconds until the next munchlax blink, randrange(r,100,370)/30"""
+    return rangefloat(rands,100,370) / 30
+
+def find_pattern(values:np.ndarray,pattern:np.ndarray)->np.ndarray:
+    """Start of every window of values equal to pattern"""
+    windows = len(values)-len(pattern)+1
+    if windows<=0:
+        return np.empty(0,dtype=np.int64)
+    found = np.ones(windows,dtype=bool)
+    for offset,value in enumerate(pattern):
+        found &= values[offset:offset+windows]==value
+    return np.flatnonzero(found)
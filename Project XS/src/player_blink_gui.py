@@ -16,6 +16,7 @@ try:
     from os import listdir
     from os.path import isfile, join
     from PIL import Image, ImageTk
+    from solver import BlinkSolver, MunchlaxSolver
     from xorshift import Xorshift
 except ImportError as import_fail:
     raise \
@@ -394,6 +395,8 @@ class PlayerBlinkGUI(tk.Frame):
     def monitoring_work(self):
         """Thread work to be for the monitoring function"""
         self.tracking = False
+        uncertain = []
+        ambiguous = []
         blinks, \
         intervals, \
         offset_time = rngtool.tracking_blink(self.player_eye,
@@ -403,9 +406,13 @@ class PlayerBlinkGUI(tk.Frame):
                                             crop=self.config_json["crop"],
                                             camera=self.config_json["camera"],
                                             tk_window=self,
-                                            threshold=self.config_json["thresh"])
+                                            threshold=self.config_json["thresh"],
+                                            solver=BlinkSolver(self.config_json["npc"]),
+                                            uncertain=uncertain,
+                                            ambiguous=ambiguous)
         try:
-            self.rng = rngtool.recov(blinks, intervals, npc=self.config_json["npc"])
+            self.rng = rngtool.recov(blinks, intervals, npc=self.config_json["npc"],
+                                     uncertain=uncertain,ambiguous=ambiguous)
         except AssertionError as failed_deduction:
             raise Exception("Failed to deduce seed from monitored blinks.") from failed_deduction
 
@@ -415,7 +422,7 @@ class PlayerBlinkGUI(tk.Frame):
 
         waituntil = time.perf_counter()
         diff = round(waituntil-offset_time)
-        self.rng.get_next_rand_sequence(diff
+        self.rng.advance(diff
             * (self.config_json["npc"] + 1))
 
         state = self.rng.get_state()
@@ -445,7 +452,8 @@ class PlayerBlinkGUI(tk.Frame):
             if self.advances == int(self.advances_increase.get()):
                 press("pgup")
                 print("Pressing pgup")
-            rand = self.rng.get_next_rand_sequence(self.config_json["npc"]+1)[-1]
+            self.rng.advance(self.config_json["npc"])
+            rand = self.rng.next()
             waituntil += 1.018
 
             print(f"advances:{self.advances}, blinks:{hex(rand&0xF)}")
@@ -512,7 +520,8 @@ class PlayerBlinkGUI(tk.Frame):
                                           camera=self.config_json["camera"],
                                           tk_window=self,
                                           threshold=self.config_json["thresh"],
-                                          size=64)
+                                          size=64,
+                                          solver=MunchlaxSolver())
         try:
             self.rng = rngtool.recov_by_munchlax(munchlax_intervals)
         except (AssertionError,IndexError) as failed_deduction:
@@ -612,7 +621,7 @@ class PlayerBlinkGUI(tk.Frame):
 
         waituntil = time.perf_counter()
         diff = round(waituntil-offset_time)
-        self.rng.get_next_rand_sequence(diff
+        self.rng.advance(diff
             * (self.config_json["npc"] + 1))
         state = self.rng.get_state()
 
@@ -637,7 +646,8 @@ class PlayerBlinkGUI(tk.Frame):
             if self.advances == int(self.advances_increase.get()):
                 press("pgup")
                 print("Pressing pgup")
-            rand = self.rng.get_next_rand_sequence(self.config_json["npc"]+1)[-1]
+            self.rng.advance(self.config_json["npc"])
+            rand = self.rng.next()
             waituntil += 1.018
 
             print(f"advances:{self.advances}, blinks:{hex(rand&0xF)}")
@@ -1,21 +1,47 @@
 """Module for recording blinks from a video capture"""
+from itertools import chain
+from itertools import islice
+from typing import Iterator
 from typing import List
 from typing import Tuple
 import time
 import sys
 import cv2
+import numpy as np
 from xorshift import Xorshift
-import calc
+from solver import BlinkSolver, BlinkCorrector, MAX_ERRORS, MAX_UNCERTAIN, MAX_AMBIGUOUS, \
+    MunchlaxSolver, resolve_types, resolve_intervals
+import advindex
+import blockcache
+import gapindex
+import gramindex
+import kernels
 
 IDLE = 0xFF
 SINGLE = 0xF0
 DOUBLE = 0xF1
+# closed eye frames this close to the 0.3 s double blink cutoff leave the type uncertain
+DOUBLE_MARGIN = 0.05
+# intervals this close to x.5 advances may have been rounded the wrong way
+INTERVAL_MARGIN = 0.1
 
 def randrange(rand,minimum,maximum):
     """Convert a random number into a range between two floats"""
     rand = (rand & 0x7fffff) / 8388607.0
     return rand * minimum + (1.0 - rand) * maximum
 
+def blink_nibble_blocks(rng:Xorshift,length:int)->Iterator[np.ndarray]:
+    """Lazily read the low 4 bits of the first length outputs of rng in blocks,
+       from a saved advance index when one covers them, otherwise through the block cache"""
+    index = advindex.find_index(rng.get_state())
+    if index is not None and index.covers(rng.get_state(),length):
+        return index.iter_nibbles(length)
+    return (block & 0xF for block in blockcache.iter_blocks(rng.get_state(),length))
+
+def blink_nibbles(rng:Xorshift,length:int)->Iterator[int]:
+    """Lazily read the low 4 bits of the first length outputs of rng"""
+    return chain.from_iterable(block.tolist() for block in blink_nibble_blocks(rng,length))
+
 # pylint: disable=too-many-arguments,too-many-branches,too-many-locals,too-many-statements
 # until made to accept a config directly, this many arguments is reasonable
 # due to this function being responsible for controlling a video capture and detecting blinks,
@@ -31,9 +57,18 @@ def tracking_blink(img,
                    window_prefix = "SysDVR-Client [PID ",
                    crop = None,
                    camera = 0,
-                   tk_window = None)->Tuple[List[int],List[int],float]:
+                   tk_window = None,
+                   solver:BlinkSolver = None,
+                   uncertain:List[int] = None,
+                   ambiguous:List[Tuple[int,int]] = None)->Tuple[List[int],List[int],float]:
     """measuring the type and interval of player's blinks
 
+    When a solver is given every blink is fed to it once its type is known,
+    and measuring stops as soon as it has solved the state.
+    When uncertain is given the indexes of blinks too close to call
+    between single and double are appended to it, and when ambiguous is given
+    the index and the other rounding of intervals close to x.5 are appended to it
+
     Returns:
         blinks:List[int], intervals:list[int], offset_time:float
     """
@@ -64,6 +99,7 @@ def tracking_blink(img,
 
     prev_roi = None
     offset_time = 0
+    cutoff_distance = 0
 
     # observe blinks
     while len(blinks)<size or state!=IDLE:
@@ -91,6 +127,9 @@ def tracking_blink(img,
                 interval = (time_counter - prev_time)/1.017
                 interval_round = round(interval)
                 intervals.append(interval_round)
+                if ambiguous is not None and abs(interval%1-0.5)<INTERVAL_MARGIN:
+                    ambiguous.append((len(intervals)-1,
+                                      interval_round+(1 if interval_round<interval else -1)))
                 print(f"Adv Since Last: {round((time_counter - prev_time)/1.018)} " \
                       f"{(time_counter - prev_time)/1.018}")
                 print("blink logged")
@@ -103,6 +142,7 @@ def tracking_blink(img,
 
                 state = SINGLE
                 prev_time = time_counter
+                cutoff_distance = 0.3
             elif state==SINGLE:
                 #doubleの判定
                 if time_counter - prev_time>0.3:
@@ -111,6 +151,7 @@ def tracking_blink(img,
                     print("double blink logged")
             elif state==DOUBLE:
                 pass
+            cutoff_distance = min(cutoff_distance,abs(time_counter - prev_time - 0.3))
         else:
             max_loc = (max_loc[0] + roi_x,max_loc[1] + roi_y)
             bottom_right = (max_loc[0] + eye_width, max_loc[1] + eye_height)
@@ -137,6 +178,16 @@ def tracking_blink(img,
             last_frame_tk = frame_tk
         if state!=IDLE and time_counter - prev_time>0.7:
             state = IDLE
+            if uncertain is not None and cutoff_distance<DOUBLE_MARGIN:
+                print("blink type uncertain")
+                uncertain.append(len(blinks)-1)
+            if solver is not None:
+                solved = solver.add_blink(blinks[-1],intervals[-1])
+                print(f"Rank {solver.rank}/128")
+                if solved:
+                    print("state solved")
+                    offset_time = prev_time
+                    break
     if tk_window is None:
         cv2.destroyAllWindows()
     else:
@@ -197,9 +248,13 @@ def tracking_poke_blink(img,
                         window_prefix = "SysDVR-Client [PID ",
                         crop = None,
                         tk_window = None,
-                        camera = 0)->Tuple[List[int],List[int],float]:
+                        camera = 0,
+                        solver:MunchlaxSolver = None)->Tuple[List[int],List[int],float]:
     """measuring the type and interval of pokemon's blinks
 
+    When a solver is given every interval is fed to it as it is measured,
+    and measuring stops as soon as it has solved the state
+
     Returns:
         intervals:list[int],offset_time:float: [description]
     """
@@ -258,6 +313,12 @@ def tracking_poke_blink(img,
                     tk_window.progress['text'] = f"{len(intervals)}/{size}"
                 state = SINGLE
                 prev_time = time_counter
+                if solver is not None:
+                    solved = solver.add_interval(interval)
+                    print(f"Rank {solver.rank}/128")
+                    if solved:
+                        print("state solved")
+                        break
             elif state==SINGLE:
                 pass
         else:
@@ -391,7 +452,8 @@ def simultaneous_tracking(plimg,
     print(intervals)
     return (blinks, intervals, offset_time)
 
-def recov(blinks:List[int],rawintervals:List[int],npc:int=0)->Xorshift:
+def recov(blinks:List[int],rawintervals:List[int],npc:int=0,uncertain:List[int]=None,
+          ambiguous:List[Tuple[int,int]]=None)->Xorshift:
     """
     Recover the xorshift from the type and interval of blinks.
 
@@ -399,46 +461,73 @@ def recov(blinks:List[int],rawintervals:List[int],npc:int=0)->Xorshift:
         blinks (List[int]):
         intervals (List[int]):
         npc (int):
+        uncertain (List[int]): indexes of blinks whose type may be wrong
+        ambiguous (List[Tuple[int,int]]): index and other rounding of intervals that may be wrong
 
     Returns:
         List[int]: internalstate
     """
-    intervals = rawintervals[1:]
-    if npc != 0:
-        intervals = [x*(npc+1) for x in intervals]
-    advanced_frame = sum(intervals)
-    states = calc.reverse_states(blinks, intervals)
-    # pylint: disable=no-value-for-parameter
-    prng = Xorshift(*states)
-    states = prng.get_state()
+    blink_solver = BlinkSolver(npc)
+    for blink, interval in zip(blinks,rawintervals):
+        blink_solver.add_blink(blink,interval)
 
     #validation check
-    if npc == 0:
-        expected_blinks = \
-            [r&0xF for r in \
-                prng.get_next_rand_sequence(advanced_frame) if r&0b1110==0]
-        paired = list(zip(blinks,expected_blinks))
-        print(blinks)
-        print(expected_blinks)
-        assert all(o==e for o,e in paired)
+    print(blinks)
+    if blink_solver.solved:
+        print(blink_solver.expected_blinks())
+        return blink_solver.get_rng()
+    if blink_solver.candidates:
+        print(f"{blink_solver.candidates} states match these blinks, log more blinks")
+    elif blink_solver.failed:
+        print("no state matches every blink")
     else:
-        raise_error = True
-        for distance in range(npc+1):
-            expected_blinks = \
-                [r&0xF for r in
-                    prng.get_next_rand_sequence(advanced_frame*npc)[distance::npc+1] if r&0b1110==0]
-            paired = list(zip(blinks,expected_blinks))
-            if all(o==e for o,e in paired):
-                advanced_frame += distance
-                raise_error = False
-                break
-        print(blinks)
-        print(expected_blinks)
-        if raise_error:
-            assert all(o==e for o,e in paired)
-    result = Xorshift(*states)
-    result.get_next_rand_sequence(advanced_frame)
-    return result
+        print(f"rank {blink_solver.rank}/128, log more blinks")
+    if uncertain and len(uncertain)>MAX_UNCERTAIN:
+        print(f"{len(uncertain)} uncertain blinks, trying to correct them as errors")
+    elif uncertain:
+        try:
+            resolved = resolve_types(blinks,rawintervals,uncertain,npc)
+        except ValueError:
+            # too few blinks to invert
+            resolved = []
+        if len(resolved)==1:
+            rng, types = resolved[0]
+            print("types:",types)
+            return rng
+    if ambiguous and len(ambiguous)>MAX_AMBIGUOUS:
+        print(f"{len(ambiguous)} ambiguous intervals, trying to correct them as errors")
+    elif ambiguous:
+        resolved = resolve_intervals(blinks,rawintervals,ambiguous,npc)
+        if len(resolved)==1:
+            rng, intervals = resolved[0]
+            print("intervals:",intervals)
+            return rng
+    # errors only explain a capture that would otherwise pin down a single state
+    assert blink_solver.candidates<=1, f"{blink_solver.candidates} states match these blinks"
+    return recov_with_errors(blinks,rawintervals,npc)
+
+def recov_with_errors(blinks:List[int],rawintervals:List[int],npc:int=0,
+                      max_errors:int=MAX_ERRORS)->Xorshift:
+    """
+    Recover the xorshift from blinks with up to max_errors flipped, dropped or
+    moved blinks or intervals off by one.
+
+    Args:
+        blinks (List[int]):
+        intervals (List[int]):
+        npc (int):
+        max_errors (int):
+
+    Returns:
+        Xorshift: rng at the last blink
+    """
+    corrector = BlinkCorrector(blinks,rawintervals,npc)
+    assert corrector.rank==128, f"rank {corrector.rank}/128, more blinks are needed"
+    corrected = corrector.correct(max_errors)
+    for _, errors in corrected:
+        print("errors:",errors)
+    assert len(corrected)==1, f"{len(corrected)} states match with up to {max_errors} errors"
+    return corrected[0][0]
 
 def reidentiy_by_blinks(rng:Xorshift,
                        observed_blinks:List[int],
@@ -466,48 +555,59 @@ def reidentiy_by_blinks(rng:Xorshift,
     if 2**observed_len < search_range:
         return None
 
-    for distance in range(1+npc):
-        identify_rng = Xorshift(*rng.get_state())
-        rands = \
-            [(i, r&0xF) for i,r in
-                list(enumerate(identify_rng.get_next_rand_sequence(search_max)))[distance::1+npc]]
-        blinkrands = [(i, r) for i,r in rands if r&0b1110==0]
-
-        #prepare
-        expected_blinks_lst = []
-        expected_blinks = 0
-        lastblink_idx = -1
-        mask = (1<<observed_len)-1
-        for idx, rand in blinkrands[:observed_len]:
-            lastblink_idx = idx
-
-            expected_blinks <<= 1
-            expected_blinks |= rand
-
-        expected_blinks_lst.append((lastblink_idx, expected_blinks))
-
-        for idx, rand in blinkrands[observed_len:]:
-            lastblink_idx = idx
-
-            expected_blinks <<= 1
-            expected_blinks |= rand
-            expected_blinks &= mask
-
-            expected_blinks_lst.append((lastblink_idx, expected_blinks))
+    #search
+    found = [None]*(1+npc)
+    index = gramindex.find_index(rng.get_state(),npc)
+    if index is not None and index.covers(rng.get_state(),search_max):
+        for idx, distance in zip(*index.find(observed_blinks,search_min,search_max)):
+            if found[distance] is None:
+                found[distance] = int(idx)
+    else:
+        found = _scan_blinks(rng,observed_blinks,npc,search_max,search_min)
 
-        #search
-        search_blinks = calc.list2bitvec(observed_blinks)
-        result = Xorshift(*rng.get_state())
-        for idx, blinks in expected_blinks_lst:
-            if search_blinks==blinks and search_min <= idx:
-                print(f"found  at advances:{idx}, distance={distance}")
-                result.get_next_rand_sequence(idx)
-                if return_advance:
-                    return result, idx
-                return result
+    for distance, idx in enumerate(found):
+        if idx is not None:
+            print(f"found  at advances:{idx}, distance={distance}")
+            result = rng.copy()
+            result.advance(idx)
+            if return_advance:
+                return result, idx
+            return result
 
     return None
 
+def _scan_blinks(rng:Xorshift,observed_blinks:List[int],npc,search_max,search_min)->List[int]:
+    """Advance of the first match ending at or after search_min for each player position"""
+    observed_len = len(observed_blinks)
+    search_blinks = np.array(observed_blinks,dtype=np.uint8)
+    # blinks of each player position among the npcs, the last observed_len-1 are
+    # carried over so windows can straddle blocks
+    positions = [np.empty(0,dtype=np.int64)]*(1+npc)
+    types = [np.empty(0,dtype=np.uint8)]*(1+npc)
+    found = [None]*(1+npc)
+    start = 0
+    for block in blink_nibble_blocks(rng,search_max):
+        blinkpositions = np.flatnonzero(kernels.blink_flags(block))
+        blinktypes = block[blinkpositions].astype(np.uint8)
+        blinkpositions += start
+        start += len(block)
+        for distance in range(1+npc):
+            if found[distance] is not None:
+                continue
+            phase = blinkpositions%(1+npc)==distance
+            positions[distance] = np.concatenate((positions[distance],blinkpositions[phase]))
+            types[distance] = np.concatenate((types[distance],blinktypes[phase]))
+            ends = positions[distance][kernels.find_pattern(types[distance],search_blinks)
+                                       +observed_len-1]
+            ends = ends[ends>=search_min]
+            if len(ends):
+                found[distance] = int(ends[0])
+            positions[distance] = positions[distance][len(positions[distance])-observed_len+1:]
+            types[distance] = types[distance][len(types[distance])-observed_len+1:]
+        if found[0] is not None or None not in found:
+            break
+    return found
+
 def reidentiy_by_intervals(rng:Xorshift,
                           rawintervals:List[int],
                           npc = 0,
@@ -531,33 +631,23 @@ def reidentiy_by_intervals(rng:Xorshift,
         search_min, search_max = search_max, search_min
     observed_len = sum(intervals)+1
 
+    index = gapindex.find_index(rng.get_state(),npc)
+    if index is not None and index.covers(rng.get_state(),search_max):
+        advances, distances = index.find(intervals,search_min,search_max)
+        if len(advances):
+            idx, distance = int(advances[0]), int(distances[0])
+            print(f"found  at advances:{idx}, distance={distance}")
+            result = rng.copy()
+            result.advance(idx)
+            if return_advance:
+                return result, idx
+            return result
+        return None
+
     for distance in range(1+npc):
-        identify_rng = Xorshift(*rng.get_state())
         blinkrands = \
-            [(i, int((r&0b1110)==0)) for i,r in
-                list(enumerate(identify_rng.get_next_rand_sequence(search_max)))[distance::1+npc]]
-
-        #prepare
-        expected_blinks_lst = []
-        expected_blinks = 0
-        lastblink_idx = -1
-        mask = (1<<observed_len)-1
-        for idx, rand in blinkrands[:observed_len]:
-            lastblink_idx = idx
-
-            expected_blinks <<= 1
-            expected_blinks |= rand
-
-        expected_blinks_lst.append((lastblink_idx, expected_blinks))
-
-        for idx, rand in blinkrands[observed_len:]:
-            lastblink_idx = idx
-
-            expected_blinks <<= 1
-            expected_blinks |= rand
-            expected_blinks &= mask
-
-            expected_blinks_lst.append((lastblink_idx, expected_blinks))
+            ((i, int((r&0b1110)==0)) for i,r in
+                islice(enumerate(blink_nibbles(rng,search_max)),distance,None,1+npc))
 
         #search preparation
         search_blinks = 1
@@ -566,11 +656,17 @@ def reidentiy_by_intervals(rng:Xorshift,
             search_blinks |= 1
 
         #search
-        result = Xorshift(*rng.get_state())
-        for idx, blinks in expected_blinks_lst:
-            if search_blinks==blinks and search_min <= idx:
+        expected_blinks = 0
+        mask = (1<<observed_len)-1
+        for count, (idx, rand) in enumerate(blinkrands, 1):
+            expected_blinks <<= 1
+            expected_blinks |= rand
+            expected_blinks &= mask
+
+            if count>=observed_len and search_blinks==expected_blinks and search_min <= idx:
                 print(f"found  at advances:{idx}, distance={distance}")
-                result.get_next_rand_sequence(idx)
+                result = rng.copy()
+                result.advance(idx)
                 if return_advance:
                     return result, idx
                 return result
@@ -591,9 +687,8 @@ def reidentiy_by_intervals_noisy(rng:Xorshift,
     possible_length = int(reident_time*4//3)
 
     possible_advances = []
-    temp_rng = Xorshift(*rng.get_state())
-    temp_rng.get_next_rand_sequence(search_min)
-    blink_rands = [int((r&0b1110)==0) for r in temp_rng.get_next_rand_sequence(search_max)]
+    blink_rands = \
+        kernels.blink_flags(blockcache.get_range(rng.get_state(),search_max,search_min)).tolist()
     for advance in range(search_max-possible_length):
         blinks = blink_rands[advance:advance+possible_length]
         i = 0
@@ -626,23 +721,14 @@ def recov_by_munchlax(rawintervals:List[float])->Xorshift:
     Returns:
         Xorshift: [description]
     """
-    advances = len(rawintervals)
-    # correct for delays in observation
-    intervals = [interval+0.048 for interval in rawintervals]
-    # ignore the first interval as its not based on a blink
-    intervals = intervals[1:]
-    states = calc.reverse_states_by_munchlax(intervals)
-
-    # pylint: disable=no-value-for-parameter
-    prng = Xorshift(*states)
-    states = prng.get_state()
+    munchlax_solver = MunchlaxSolver()
+    for interval in rawintervals:
+        munchlax_solver.add_interval(interval)
 
     #validation check
-    expected_intervals = [randrange(r,100,370)/30 for r in prng.get_next_rand_sequence(advances)]
-
-    paired = list(zip(intervals,expected_intervals))
-
-    assert all(abs(o-e)<0.1 for o,e in paired)
-    result = Xorshift(*states)
-    result.get_next_rand_sequence(len(intervals))
-    return result
+    if munchlax_solver.candidates>1:
+        print(f"{munchlax_solver.candidates} states match these intervals, log more blinks")
+    elif not munchlax_solver.solved:
+        print(f"rank {munchlax_solver.rank}/128, log more blinks")
+    assert munchlax_solver.solved
+    return munchlax_solver.get_rng()
@@ -0,0 +1,570 @@
+"""Module for solving Xorshift states from blinks as they are observed"""
+from functools import reduce
+from typing import List, Tuple
+import numpy as np
+from gf2 import GF2Eliminator, GF2Matrix, combine_rows
+from xorshift import Xorshift, XorshiftLanes
+import calc
+import kernels
+
+MAX_NULLITY = 16
+
+def candidate_states(particular:int,basis:List[int])->np.ndarray:
+    """Every state of the affine solution space as a (4, 2**len(basis)) seed array"""
+    index = np.arange(1<<len(basis),dtype=np.uint64)
+    seeds = np.empty((4,len(index)),dtype=np.uint32)
+    for word in range(4):
+        shift = 96-32*word
+        seeds[word] = particular>>shift & 0xFFFFFFFF
+        for i,vector in enumerate(basis):
+            bits = vector>>shift & 0xFFFFFFFF
+            if bits:
+                seeds[word][(index>>np.uint64(i)&np.uint64(1)).astype(bool)] ^= np.uint32(bits)
+    return seeds
+
+def filter_candidates(seeds:np.ndarray,steps:List[int],blinks:List[int],
+                      npc:int=0)->np.ndarray:
+    """Keep the candidate states whose player advances blink exactly at steps
+       with the given types
+
+    The states are solved from the first blink, so the player's advances are
+    every (npc+1)th output from it. Every candidate is simulated side by side
+    in blocks that double in length as mismatches are pruned
+
+    Args:
+        seeds (np.ndarray): (4, K) candidate states
+        steps (List[int]): player advance of each blink, the first is 0
+        blinks (List[int]): type of each blink
+        npc (int, optional): num of npcs. Defaults to 0.
+
+    Returns:
+        np.ndarray: (4, K') surviving states
+    """
+    expected = np.full(steps[-1]+1,-1,dtype=np.int8)
+    expected[steps] = blinks
+    survivors = seeds
+    lanes = XorshiftLanes(*seeds)
+    start,length = 0,8
+    while start<len(expected) and len(lanes):
+        observed = expected[start:start+length,None]
+        rands = lanes.get_next_rand_block(len(observed)*(npc+1))[::npc+1]
+        flags = kernels.blink_flags(rands)
+        keep = np.where(observed<0,~flags,flags&(kernels.blink_types(rands)==observed)).all(0)
+        survivors = survivors[:,keep]
+        lanes = XorshiftLanes(*lanes.get_state()[:,keep])
+        start,length = start+length,length*2
+    return survivors
+
+class BlinkSolver:
+    """Incremental state solver fed one player blink at a time
+
+    The four observation rows of each blink are eliminated as it is logged.
+    Once at most MAX_NULLITY bits are left free every state of the solution
+    space is checked against every blink so far, so a unique state is usually
+    found a few blinks before rank 128. If no state matches the oldest blink
+    is dropped and the remaining window is solved again as more blinks arrive
+
+    Args:
+        npc (int, optional): num of npcs. Defaults to 0.
+        window (int, optional): most blinks solved together. Defaults to 40.
+    """
+    def __init__(self,npc:int=0,window:int=40):
+        self.npc = npc
+        self.window = window
+        self.blinks = []
+        self.offsets = []
+        self.start = 0
+        self.state = None
+        self.failed = False
+        self.candidates = 0
+        self._eliminator = None
+        self._rows = None
+
+    @property
+    def solved(self)->bool:
+        """Whether a validated state is available"""
+        return self.state is not None
+
+    @property
+    def rank(self)->int:
+        """Rank of the blinks in the current window"""
+        return self._eliminator.rank if self._eliminator is not None else 0
+
+    def add_blink(self,blink:int,interval:int)->bool:
+        """Log a blink of type blink (0 = single, 1 = double) seen interval advances
+           after the previous one (ignored for the first blink)
+
+        Returns:
+            bool: whether the state is solved and matches every blink in the window
+        """
+        offset = self.offsets[-1]+interval*(self.npc+1) if self.offsets else 0
+        self.blinks.append(blink)
+        self.offsets.append(offset)
+        if len(self.blinks)-self.start>self.window:
+            self._rebuild(len(self.blinks)-self.window)
+        elif self.failed:
+            # an earlier blink may be wrong, slide past it
+            self._rebuild(self.start+1)
+        else:
+            self._add_rows(len(self.blinks)-1)
+        self._try_solve()
+        return self.solved
+
+    def get_rng(self)->Xorshift:
+        """Get the rng at the last blink, like rngtool.recov returns it"""
+        rng = Xorshift(*self.state)
+        rng.advance(self.offsets[-1]-self.offsets[self.start])
+        return rng
+
+    def expected_blinks(self)->List[int]:
+        """Blink types the solved state produces over the window"""
+        rands = self._player_rands()
+        return kernels.blink_types(rands[kernels.blink_flags(rands)]).tolist()
+
+    def _add_rows(self,index:int):
+        if index==self.start:
+            # the low 4 bits of seed_3 after the first advance
+            self._eliminator = GF2Eliminator(128)
+            self._rows = calc.get_trans_rows(1,124,128)
+        else:
+            self._rows = calc.advance_rows(self._rows,self.offsets[index]-self.offsets[index-1])
+        observed = [0,0,0,self.blinks[index]]
+        for row,bit in zip(self._rows.rows,observed):
+            self._eliminator.add_row(row,bit)
+
+    def _rebuild(self,start:int):
+        self.start = start
+        self.state = None
+        for index in range(start,len(self.blinks)):
+            self._add_rows(index)
+
+    def _player_rands(self)->np.ndarray:
+        rng = Xorshift(*self.state)
+        length = self.offsets[-1]-self.offsets[self.start]+1
+        return rng.get_next_rand_block(length)[::self.npc+1]
+
+    @property
+    def steps(self)->int:
+        """Player advances spanned by the window"""
+        return (self.offsets[-1]-self.offsets[self.start])//(self.npc+1)+1
+
+    def _try_solve(self):
+        self.state = None
+        self.candidates = 0
+        if not self._eliminator.consistent:
+            self.failed = True
+            return
+        if self.rank<128-MAX_NULLITY:
+            return
+        seeds = candidate_states(*self._eliminator.solution_space())
+        steps = [(offset-self.offsets[self.start])//(self.npc+1)
+                 for offset in self.offsets[self.start:]]
+        survivors = filter_candidates(seeds,steps,self.blinks[self.start:],self.npc)
+        self.candidates = survivors.shape[1]
+        self.failed = not self.candidates
+        if self.candidates==1:
+            self.state = survivors[:,0].tolist()
+
+# seconds munchlax blinks are observed late by
+MUNCHLAX_DELAY = 0.048
+# largest difference in seconds between an observed and a simulated munchlax interval
+MUNCHLAX_MARGIN = 0.1
+
+class MunchlaxSolver:
+    """Incremental state solver fed one munchlax blink interval at a time
+
+    Every interval gives bits 22-19 of its output. When it is close to a
+    bucket boundary either neighbouring bucket is plausible, so the bits
+    they disagree on get a hypothesis variable packed into the rhs next to
+    the observed bits. One elimination then serves every combination: a row
+    reducing to zero constrains the variables, and the solution is affine in
+    them. Once at most MAX_NULLITY bits of the state and the variables are
+    left free every candidate is simulated against all the intervals so far.
+    If none matches, the oldest interval is dropped and the rest are solved
+    again as more arrive
+    """
+    def __init__(self):
+        self.rawintervals = []
+        self.intervals = []
+        self.start = 0
+        self.state = None
+        self.failed = False
+        self.candidates = 0
+        self._eliminator = None
+        self._outputs = None
+        self._checks = []
+        self._variables = 0
+
+    @property
+    def solved(self)->bool:
+        """Whether a validated state is available"""
+        return self.state is not None
+
+    @property
+    def rank(self)->int:
+        """Rank of the intervals since start"""
+        return self._eliminator.rank if self._eliminator is not None else 0
+
+    def add_interval(self,rawinterval:float)->bool:
+        """Log the seconds since the previous munchlax blink, as tracking_poke_blink
+           measures them (the first is ignored as its not based on a blink)
+
+        Returns:
+            bool: whether the state is solved and matches every interval since start
+        """
+        self.rawintervals.append(rawinterval)
+        if len(self.rawintervals)==1:
+            return False
+        self.intervals.append(rawinterval+MUNCHLAX_DELAY)
+        if self.failed:
+            # an earlier interval may be wrong, slide past it
+            self._rebuild(self.start+1)
+        else:
+            self._add_rows(len(self.intervals)-1)
+        self._try_solve()
+        return self.solved
+
+    def get_rng(self)->Xorshift:
+        """Get the rng after the last interval, like rngtool.recov_by_munchlax returns it"""
+        rng = Xorshift(*self.state)
+        rng.advance(len(self.intervals)-self.start)
+        return rng
+
+    def _add_rows(self,index:int):
+        if index==self.start:
+            self._eliminator = GF2Eliminator(128)
+            self._outputs = calc.get_trans_rows(1,96,128)
+            self._checks = []
+            self._variables = 0
+        else:
+            self._outputs = calc.advance_rows(self._outputs,1)
+        lower,upper = calc.munchlax_buckets(self.intervals[index])
+        # bit 0 of the rhs is the upper bucket,
+        # bit 1+v flips to the lower one when variable v is set
+        variable = 0
+        if lower!=upper:
+            variable = 1<<(1+self._variables)
+            self._variables += 1
+        for bit in range(3,-1,-1):
+            rhs = (upper>>bit&1)|(variable if (lower^upper)>>bit&1 else 0)
+            row,rhs = self._eliminator.reduce(self._outputs.rows[31-(19+bit)],rhs)
+            if row:
+                self._eliminator.add_row(row,rhs)
+            elif rhs:
+                self._checks.append(rhs)
+
+    def _rebuild(self,start:int):
+        self.start = start
+        self.state = None
+        self._eliminator = None
+        for index in range(start,len(self.intervals)):
+            self._add_rows(index)
+
+    def _candidates(self)->np.ndarray:
+        """Every state the observed bits allow under some choice of buckets, None when
+           there are too many to enumerate and an empty array when there are none"""
+        constraints = GF2Eliminator(self._variables)
+        for check in self._checks:
+            constraints.add_row(check>>1,check&1)
+        if not constraints.consistent:
+            return np.empty((4,0),dtype=np.uint32)
+        if 128-self.rank+self._variables-constraints.rank>MAX_NULLITY:
+            return None
+        choice,choice_basis = constraints.solution_space()
+        # the solution is affine in the variables, variable v moves it by effects[-1-v]
+        effects = [self._eliminator.particular(1+variable)
+                   for variable in reversed(range(self._variables))]
+        _, basis = self._eliminator.solution_space()
+        return candidate_states(self._eliminator.particular()^combine_rows(choice,effects),
+                                basis+[combine_rows(vector,effects) for vector in choice_basis])
+
+    def _try_solve(self):
+        self.state = None
+        self.candidates = 0
+        if self._eliminator is None:
+            return
+        seeds = self._candidates()
+        if seeds is None:
+            return
+        observed = np.array(self.intervals[self.start:])
+        rands = XorshiftLanes(*seeds).get_next_rand_block(len(observed))
+        expected = kernels.munchlax_intervals(rands)
+        close = (np.abs(expected-observed[:,None])<MUNCHLAX_MARGIN).all(0)
+        matches = np.unique(seeds[:,close],axis=1)
+        self.candidates = matches.shape[1]
+        self.failed = self.candidates==0
+        if self.candidates==1:
+            self.state = matches[:,0].tolist()
+
+# every uncertain blink doubles the hypotheses resolve_types solves and simulates
+MAX_UNCERTAIN = 10
+
+def resolve_types(blinks:List[int],intervals:List[int],uncertain:List[int],
+                  npc:int=0)->List[Tuple[Xorshift,List[int]]]:
+    """Solve every type assignment of the uncertain blinks in one batch
+       and simulate all of them side by side against the whole capture
+
+    Args:
+        blinks (List[int]): type of each blink
+        intervals (List[int]): advances since the previous blink (the first is ignored)
+        uncertain (List[int]): indexes of the blinks whose type may be wrong
+        npc (int, optional): num of npcs. Defaults to 0.
+
+    Returns:
+        List[Tuple[Xorshift,List[int]]]: rng at the last blink and the blink types, for every match
+    """
+    intervals = [interval*(npc+1) for interval in intervals[1:len(blinks)]]
+    states = calc.reverse_states_by_types(blinks,intervals,uncertain)
+    offsets = np.cumsum([0]+intervals)
+    steps = offsets//(npc+1)
+    hypothesis = np.arange(len(states))
+    types = np.array([blinks]*len(states)).T
+    for i,index in enumerate(uncertain):
+        types[index] ^= hypothesis>>i&1
+    expected = np.zeros(steps[-1]+1,dtype=bool)
+    expected[steps] = True
+    rands = XorshiftLanes.from_states(states).get_next_rand_block(int(offsets[-1])+1)[::npc+1]
+    match = (kernels.blink_flags(rands)==expected[:,None]).all(0) \
+        & (kernels.blink_types(rands[steps])==types).all(0)
+    results = []
+    for lane in np.flatnonzero(match).tolist():
+        rng = Xorshift(*states[lane])
+        rng.advance(int(offsets[-1]))
+        results.append((rng,types[:,lane].tolist()))
+    return results
+
+# every ambiguous interval may double the branches resolve_intervals eliminates,
+# none are pruned until the rows reach full rank
+MAX_AMBIGUOUS = 8
+
+def resolve_intervals(blinks:List[int],intervals:List[int],ambiguous:List[Tuple[int,int]],
+                      npc:int=0)->List[Tuple[Xorshift,List[int]]]:
+    """Solve the capture for every choice of the ambiguous intervals
+
+    The choices form a tree walked in blink order, so all the choices that
+    agree up to a blink share the elimination of the blinks before it, and a
+    branch is pruned as soon as its rows are inconsistent
+
+    Args:
+        blinks (List[int]): type of each blink
+        intervals (List[int]): advances since the previous blink (the first is ignored)
+        ambiguous (List[Tuple[int,int]]): index and alternative value of each ambiguous interval
+        npc (int, optional): num of npcs. Defaults to 0.
+
+    Returns:
+        List[Tuple[Xorshift,List[int]]]: rng at the last blink and the intervals, for every match
+    """
+    alternatives = dict(ambiguous)
+    results = []
+    stack = [(0,GF2Eliminator(128),None,[])]
+    while stack:
+        index,eliminator,rows,chosen = stack.pop()
+        if index==len(blinks):
+            results.extend(_check_intervals(eliminator,blinks,chosen,npc))
+            continue
+        options = [intervals[index]]
+        if index and index in alternatives:
+            options.append(alternatives[index])
+        for option,interval in enumerate(options):
+            branch = eliminator.copy() if option<len(options)-1 else eliminator
+            # the low 4 bits of seed_3 after the first advance
+            branch_rows = calc.advance_rows(rows,interval*(npc+1)) if index \
+                else calc.get_trans_rows(1,124,128)
+            for row,bit in zip(branch_rows.rows,[0,0,0,blinks[index]]):
+                branch.add_row(row,bit)
+            if branch.consistent:
+                stack.append((index+1,branch,branch_rows,chosen+[interval]))
+    return results
+
+def _check_intervals(eliminator:GF2Eliminator,blinks:List[int],intervals:List[int],
+                     npc:int)->List[Tuple[Xorshift,List[int]]]:
+    if eliminator.rank<128-MAX_NULLITY:
+        return []
+    seeds = candidate_states(*eliminator.solution_space())
+    steps = np.cumsum([0]+intervals[1:]).tolist()
+    results = []
+    for state in filter_candidates(seeds,steps,blinks,npc).T.tolist():
+        rng = Xorshift(*state)
+        rng.advance(steps[-1]*(npc+1))
+        results.append((rng,intervals))
+    return results
+
+MAX_ERRORS = 2
+
+class BlinkCorrector:
+    """Recover the state from a capture with a few wrong blinks
+
+    An error is a flipped blink type, a dropped blink (a false positive or a
+    blink logged at the wrong time) or an interval off by one. The rows of
+    every blink are eliminated once with each row tagged by its index, so the
+    rows that reduce to zero give the parity checks of the capture. Flips and
+    drops are then decoded from the syndrome of the observed bits, and each
+    interval shift only re-eliminates the blinks after it
+
+    Args:
+        blinks (List[int]): type of each blink
+        intervals (List[int]): advances since the previous blink (the first is ignored)
+        npc (int, optional): num of npcs. Defaults to 0.
+    """
+    def __init__(self,blinks:List[int],intervals:List[int],npc:int=0):
+        self.blinks = list(blinks)
+        self.npc = npc
+        self.offsets = [0]
+        for interval in intervals[1:len(blinks)]:
+            self.offsets.append(self.offsets[-1]+interval*(npc+1))
+        # rows of every blink with its offset moved by -1, 0 and 1 player advances,
+        # each advanced from the one before so only short powers are needed
+        self._rows = {}
+        for shift in (-1,0,1):
+            rows,previous,previous_offset = [],None,0
+            for offset in self.offsets:
+                offset += shift*(npc+1)
+                if offset<0:
+                    rows.append(None)
+                    continue
+                # the low 4 bits of seed_3 after the first advance
+                previous = calc.get_trans_rows(1+offset,124,128) if previous is None \
+                    else calc.advance_rows(previous,offset-previous_offset)
+                previous_offset = offset
+                rows.append(previous.rows)
+            self._rows[shift] = rows
+        self._observed = 0
+        for index,blink in enumerate(self.blinks):
+            self._observed |= blink<<(4*index+3)
+        # eliminator state before each blink, shared by every shift after it
+        self._snapshots = []
+        eliminator,checks = GF2Eliminator(128),[]
+        for index in range(len(self.blinks)):
+            self._snapshots.append((eliminator.copy(),list(checks)))
+            self._eliminate(eliminator,checks,index,0)
+        self._nominal = (eliminator,checks)
+
+    @property
+    def rank(self)->int:
+        """Rank of the capture as logged, corrections are only found at full rank"""
+        return self._nominal[0].rank
+
+    def _eliminate(self,eliminator:GF2Eliminator,checks:List[int],index:int,shift:int):
+        for i,row in enumerate(self._rows[shift][index]):
+            row,tag = eliminator.reduce(row,1<<(4*index+i))
+            if row:
+                eliminator.add_row(row,tag)
+            else:
+                # the row is a combination of earlier ones, the tags say which
+                checks.append(tag)
+
+    def _shifted(self,start:int,shift:int)->List[int]:
+        eliminator,checks = self._snapshots[start]
+        eliminator,checks = eliminator.copy(),list(checks)
+        for index in range(start,len(self.blinks)):
+            self._eliminate(eliminator,checks,index,shift)
+        return checks
+
+    def _decode(self,checks:List[int],max_errors:int)->List[List[Tuple[str,int]]]:
+        """Every set of at most max_errors flips and drops explaining the syndrome"""
+        if not checks:
+            return [[]]
+        columns = GF2Matrix(checks,4*len(self.blinks)).transpose().rows[::-1]
+        syndrome = reduce(lambda p,q: p^q,
+                          (columns[row] for row in range(len(columns)) if self._observed>>row&1),0)
+        if syndrome==0:
+            return [[]]
+        if max_errors==0:
+            return []
+        singles = {}
+        for index in range(len(self.blinks)):
+            singles.setdefault(columns[4*index+3],[]).append(("flip",index))
+            block = columns[4*index:4*index+4]
+            patterns = [0]
+            for column in block:
+                patterns += [pattern^column for pattern in patterns]
+            for pattern in patterns[1:]:
+                singles.setdefault(pattern,[]).append(("drop",index))
+        found = [[error] for error in singles.get(syndrome,[])]
+        if max_errors>1:
+            for pattern,errors in singles.items():
+                for first in errors:
+                    for second in singles.get(syndrome^pattern,[]):
+                        if first[1]<second[1]:
+                            found.append([first,second])
+        return found
+
+    def _check(self,errors:List[Tuple])->List[Tuple[Xorshift,List[Tuple]]]:
+        """Solve the capture with the errors corrected and simulate it against every blink
+
+        Returns:
+            List[Tuple[Xorshift,List[Tuple]]]: rng at the last blink and report, if it matches
+        """
+        shift = ([0]+[error[2] for error in errors if error[0]=="shift"])[-1]
+        start = ([len(self.blinks)]+[error[1] for error in errors if error[0]=="shift"])[-1]
+        flipped = {error[1] for error in errors if error[0]=="flip"}
+        dropped = {error[1] for error in errors if error[0]=="drop"}
+        offsets = [offset+(shift*(self.npc+1) if index>=start else 0)
+                   for index,offset in enumerate(self.offsets)]
+        eliminator = GF2Eliminator(128)
+        for index,blink in enumerate(self.blinks):
+            if index in dropped:
+                continue
+            rows = self._rows[shift if index>=start else 0][index]
+            for row,bit in zip(rows,[0,0,0,blink^(index in flipped)]):
+                eliminator.add_row(row,bit)
+        if eliminator.rank<128 or not eliminator.consistent:
+            return []
+        solution = eliminator.solve()
+        state = calc.unpack_state(solution)
+        expected = {offsets[index]//(self.npc+1):blink^(index in flipped)
+                    for index,blink in enumerate(self.blinks) if index not in dropped}
+        last = offsets[-1]//(self.npc+1)
+        rands = Xorshift(*state).get_next_rand_block((last+2)*(self.npc+1))[::self.npc+1]
+        flags = kernels.blink_flags(rands)
+        predicted = dict(zip(np.flatnonzero(flags).tolist(),
+                             kernels.blink_types(rands[flags]).tolist()))
+        report = [error for error in errors if error[0]!="drop"]
+        # the rng is returned at the last blink, wherever it turns out to have been
+        end = offsets[-1]
+        for index in sorted(dropped):
+            step = offsets[index]//(self.npc+1)
+            moved = [step+move for move in (-1,0,1) if step+move in predicted
+                     and step+move not in expected]
+            if moved:
+                del predicted[moved[0]]
+                report.append(("move",index,moved[0]-step))
+                if index==len(self.blinks)-1:
+                    end += (moved[0]-step)*(self.npc+1)
+            else:
+                report.append(("drop",index))
+        if {step:blink for step,blink in predicted.items() if step<=last}!=expected:
+            return []
+        rng = Xorshift(*state)
+        rng.advance(end)
+        return [(rng,report)]
+
+    def correct(self,max_errors:int=MAX_ERRORS)->List[Tuple[Xorshift,List[Tuple]]]:
+        """Every distinct state explained by the fewest errors, at most max_errors,
+           as the rng at the last blink (like rngtool.recov) and the errors
+
+        Errors are ("flip", blink), ("drop", blink), ("move", blink, advances)
+        and ("shift", interval, ±1), at most one of them an interval shift
+        """
+        hypotheses = [(errors,[]) for errors in self._decode(self._nominal[1],max_errors)]
+        if max_errors:
+            for start in range(1,len(self.blinks)):
+                for shift in (-1,1):
+                    if self._rows[shift][start] is None:
+                        continue
+                    errors = [("shift",start,shift)]
+                    checks = self._shifted(start,shift)
+                    hypotheses.extend((decoded,errors)
+                                      for decoded in self._decode(checks,max_errors-1))
+        found = {}
+        smallest = None
+        for decoded,errors in sorted(hypotheses,
+                                     key=lambda hypothesis:len(hypothesis[0])+len(hypothesis[1])):
+            if smallest is not None and len(decoded)+len(errors)>smallest:
+                # a larger explanation of the same capture is less likely, not another answer
+                break
+            # explanations anchored at different blinks may describe the same rng
+            for rng,report in self._check(errors+decoded):
+                found.setdefault(rng.to_int(),(rng,report))
+                smallest = len(decoded)+len(errors)
+        return list(found.values())
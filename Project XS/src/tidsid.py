@@ -1,9 +1,10 @@
 import rngtool
 import calc
+import kernels
 import cv2
 import time
 import json
-from xorshift import Xorshift
+from solver import MunchlaxSolver
 
 config = json.load(open("./configs/config_munchlax.json"))
 
@@ -33,14 +34,14 @@ def expr():
     if munch_eye is None:
         print("path is wrong")
         return
-    gombe_intervals = rngtool.tracking_poke_blink(munch_eye, *config["view"], size=64, monitor_window=config["MonitorWindow"], window_prefix=config["WindowPrefix"])
+    gombe_intervals = rngtool.tracking_poke_blink(munch_eye, *config["view"], size=64, monitor_window=config["MonitorWindow"], window_prefix=config["WindowPrefix"], solver=MunchlaxSolver())
 
     interval_prng = rngtool.recov_by_munchlax(gombe_intervals)
     state = interval_prng.get_state()
 
     #timecounter reset
     advances = 0
-    id_prng = Xorshift(*interval_prng.get_state())
+    id_prng = interval_prng.copy()
     id_prng.next()
     
     waituntil = time.perf_counter()
@@ -75,16 +76,18 @@ def test():
     print("input trainer ID")
     playerid = int(input())
 
-    for i in range(10000):
-        r = prng.prev()
+    backward_rands = prng.copy().get_prev_rand_sequence(10000)
+    for i,r in enumerate(backward_rands):
         g7tid = ((r%0xFFFFFFFF+0x80000000)&0xFFFFFFFF)%1000000
         tid,sid = r&0xFFFFFFFF, r>>16
         if g7tid==playerid:
             print(f"backwarding {i},", hex(tid),hex(sid))
+            prng.rewind(i+1)
             break
+    else:
+        prng.rewind(len(backward_rands))
     
-    randlist = prng.get_prev_rand_sequence(100)
-    expected_intervals = [randrange(r,100.0,370.0)/30.0 for r in randlist]
+    expected_intervals = kernels.munchlax_intervals(prng.get_prev_rand_block(100)).tolist()
     
     print(f"observed:{gombe_intervals[::-1]}")
     print(f"expected:{expected_intervals}")
@@ -96,15 +99,17 @@ def main():
     print("input trainer ID")
     playerid = int(input())
 
-    for i in range(10000):
-        r = prng.prev()
+    backward_rands = prng.copy().get_prev_rand_sequence(10000)
+    for i,r in enumerate(backward_rands):
         g7tid = ((r%0xffffffff+0x80000000)&0xFFFFFFFF)%1000000
         tid,sid = r&0xFFFFFFFF, r>>16
         if g7tid==playerid:
             print(f"backwarding {i},", hex(tid),hex(sid))
+            prng.rewind(i+1)
             break
-    randlist = prng.get_prev_rand_sequence(100)
-    expected_intervals = [randrange(r,100.0,370.0)/30.0 for r in randlist]
+    else:
+        prng.rewind(len(backward_rands))
+    expected_intervals = kernels.munchlax_intervals(prng.get_prev_rand_block(100)).tolist()
     
     print(f"expected:{expected_intervals}")
 
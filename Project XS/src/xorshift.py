@@ -1,12 +1,243 @@
 """Xorshift Random Number Generator"""
+from functools import lru_cache
+from typing import Iterator
+from typing import Tuple
+import numpy as np
+import calc
+import kernels
+
+# distances below this are cheaper to step through with next() than to jump
+JUMP_THRESHOLD = 128
+# sequences shorter than this are generated one python int at a time
+LANE_THRESHOLD = 4096
+MAX_LANES = 1<<16
+# block size used to feed iter_next
+ITER_CHUNK = 1<<16
+# caps on the baby step table and giant step lanes of distance_to
+MAX_BABY_STEPS = 1<<22
+MAX_GIANT_LANES = 1<<12
+
+def _unpack(state):
+    """Split a 128 bit vector back into four 32 bit seeds"""
+    return [state>>96 & 0xFFFFFFFF, state>>64 & 0xFFFFFFFF,
+            state>>32 & 0xFFFFFFFF, state & 0xFFFFFFFF]
+
+def _apply_columns(columns,vec):
+    """Multiply a GF(2) matrix stored as columns by a 128 bit vector"""
+    result = 0
+    bit = 0
+    while vec:
+        if vec&1:
+            result ^= columns[bit]
+        vec >>= 1
+        bit += 1
+    return result
+
+class _JumpTable:
+    """Lazily built columns of M^(2^k) for a 128x128 GF(2) matrix M
+
+    columns[b] is the image of the unit vector 1<<b
+    """
+    def __init__(self,columns):
+        self.powers = [columns]
+
+    def get_power(self,k):
+        """Get the columns of M^(2^k)"""
+        while len(self.powers)<=k:
+            last = self.powers[-1]
+            self.powers.append([_apply_columns(last,column) for column in last])
+        return self.powers[k]
+
+    def apply(self,k,state):
+        """Compute M^(2^k) @ state"""
+        return _apply_columns(self.get_power(k),state)
+
+    def apply_lanes(self,k,seeds):
+        """Compute M^(2^k) @ state for every lane of a (4,lanes) uint32 array"""
+        return _apply_columns_lanes(self.get_power(k),seeds)
+
+    def jump(self,state,length):
+        """Compute M^length @ state"""
+        k = 0
+        while length:
+            if length&1:
+                state = self.apply(k,state)
+            length >>= 1
+            k += 1
+        return state
+
+class _TransJumpTable(_JumpTable):
+    """Powers of the transition matrix, read row by row from calc.get_power_table()
+       so the process holds a single copy of them"""
+    def __init__(self):
+        super().__init__(None)
+
+    def get_power(self,k):
+        """Get the columns of T^(2^k)"""
+        # column j of the matrix acts on bit 127-j of the packed state
+        return calc.get_trans_power_of_two(k).transpose().rows[::-1]
+
+    def apply(self,k,state):
+        return calc.get_trans_power_of_two(k).dot(state)
+
+    def apply_lanes(self,k,seeds):
+        return _apply_rows_lanes(calc.get_trans_power_of_two(k).rows,seeds)
+
+def _inverse_trans_columns():
+    """Columns of the inverse transition matrix, read off prev() on each unit vector"""
+    columns = []
+    for bit in range(128):
+        rng = Xorshift.from_int(1<<bit)
+        rng.prev()
+        columns.append(rng.to_int())
+    return columns
+
+@lru_cache(maxsize=None)
+def _forward_table():
+    return _TransJumpTable()
+
+@lru_cache(maxsize=None)
+def _backward_table():
+    return _JumpTable(_inverse_trans_columns())
+
+def jump_ahead(state,length):
+    """Advance a packed 128 bit state by length using transition matrix powers,
+       negative lengths jump backwards"""
+    if length<0:
+        return _backward_table().jump(state,-length)
+    return _forward_table().jump(state,length)
+
+def _lane_count(length):
+    """Number of lanes that balances lane setup against per step overhead"""
+    return max(1,min(MAX_LANES,int(length**0.5)))
+
+@lru_cache(maxsize=64)
+def _stride_columns(stride):
+    """Columns of T^stride, kept for the lane spacings that get reused"""
+    if stride>0:
+        return calc.get_trans_rows(stride,0,128).transpose().rows[::-1]
+    return [jump_ahead(1<<bit,stride) for bit in range(128)]
+
+def _lane_seeds(state,lanes,stride):
+    """Get the seeds of lanes starting stride advances apart as a (4,lanes) uint32 array,
+       negative strides place the lanes backwards"""
+    columns = _stride_columns(stride)
+    seeds = np.empty((4,lanes),dtype=np.uint32)
+    for lane in range(lanes):
+        seeds[:,lane] = _unpack(state)
+        state = _apply_columns(columns,state)
+    return seeds
+
+def _apply_columns_lanes(columns,seeds):
+    """Multiply a GF(2) matrix stored as columns by every lane of a (4,lanes) uint32 array"""
+    words = np.array([_unpack(column) for column in columns],dtype=np.uint32)
+    result = np.zeros_like(seeds)
+    for bit in range(128):
+        # all ones in the lanes where this bit of the state is set
+        mask = (seeds[3-bit//32] >> bit%32 & 1) * np.uint32(0xFFFFFFFF)
+        result ^= words[bit][:,None] & mask
+    return result
+
+def _apply_rows_lanes(rows,seeds):
+    """Multiply a GF(2) matrix stored as rows by every lane of a (4,lanes) uint32 array,
+       row i lands in bit 127-i"""
+    words = np.array([_unpack(row) for row in rows],dtype=np.uint32)
+    result = np.zeros_like(seeds)
+    for i,word in enumerate(words):
+        dot = seeds[0]&word[0] ^ seeds[1]&word[1] ^ seeds[2]&word[2] ^ seeds[3]&word[3]
+        for shift in (16,8,4,2,1):
+            dot ^= dot>>np.uint32(shift)
+        result[i//32] |= (dot&np.uint32(1))<<np.uint32(31-i%32)
+    return result
+
+def _fill_next_rows(block):
+    """Step the lanes of a (rows,lanes) uint32 array in place
+
+    Rows 0-3 hold the starting seeds, every later row is the output of one step
+    and doubles as seed_3 of the state after it
+    """
+    temp = np.empty(block.shape[1],dtype=np.uint32)
+    for i in range(4,len(block)):
+        row = block[i]
+        np.left_shift(block[i-4],11,out=row)
+        row ^= block[i-4]
+        np.right_shift(row,8,out=temp)
+        row ^= temp
+        row ^= block[i-1]
+        np.right_shift(block[i-1],19,out=temp)
+        row ^= temp
+
+def _fill_prev_rows(block):
+    """Step the lanes of a (rows,lanes) uint32 array back in place
+
+    Rows 0-3 hold the starting seeds from seed_3 down to seed_0,
+    every later row is the seed_0 recovered by one step back
+    """
+    temp = np.empty(block.shape[1],dtype=np.uint32)
+    for i in range(4,len(block)):
+        row = block[i]
+        np.right_shift(block[i-3],19,out=row)
+        row ^= block[i-3]
+        row ^= block[i-4]
+        np.right_shift(row,8,out=temp)
+        row ^= temp
+        np.right_shift(row,16,out=temp)
+        row ^= temp
+        np.left_shift(row,11,out=temp)
+        row ^= temp
+        np.left_shift(row,22,out=temp)
+        row ^= temp
+
 class Xorshift:
     """Xorshift Random Number Generator"""
+    __slots__ = ("seed_0","seed_1","seed_2","seed_3")
+
     def __init__(self,seed_0,seed_1,seed_2,seed_3):
         self.seed_0 = seed_0
         self.seed_1 = seed_1
         self.seed_2 = seed_2
         self.seed_3 = seed_3
 
+    @classmethod
+    def from_int(cls,state:int)->"Xorshift":
+        """Create from a packed 128 bit state, seed_0 in the highest bits"""
+        return cls(state>>96 & 0xFFFFFFFF, state>>64 & 0xFFFFFFFF,
+                   state>>32 & 0xFFFFFFFF, state & 0xFFFFFFFF)
+
+    def to_int(self)->int:
+        """Get the state packed into one 128 bit integer, seed_0 in the highest bits"""
+        return self.seed_0<<96 | self.seed_1<<64 | self.seed_2<<32 | self.seed_3
+
+    def set_int(self,state:int):
+        """Set the state from a packed 128 bit integer"""
+        self.seed_0 = state>>96 & 0xFFFFFFFF
+        self.seed_1 = state>>64 & 0xFFFFFFFF
+        self.seed_2 = state>>32 & 0xFFFFFFFF
+        self.seed_3 = state & 0xFFFFFFFF
+
+    def copy(self)->"Xorshift":
+        """Get an independent rng at the same state"""
+        clone = Xorshift.__new__(Xorshift)
+        clone.seed_0 = self.seed_0
+        clone.seed_1 = self.seed_1
+        clone.seed_2 = self.seed_2
+        clone.seed_3 = self.seed_3
+        return clone
+
+    def __eq__(self,other):
+        if not isinstance(other,Xorshift):
+            return NotImplemented
+        return self.seed_0==other.seed_0 and self.seed_1==other.seed_1 \
+            and self.seed_2==other.seed_2 and self.seed_3==other.seed_3
+
+    def __hash__(self):
+        # follows the current state, so use copy() for keys that must not move
+        return hash((self.seed_0,self.seed_1,self.seed_2,self.seed_3))
+
+    def __repr__(self):
+        return f"Xorshift({self.seed_0:#010x}, {self.seed_1:#010x}, " \
+               f"{self.seed_2:#010x}, {self.seed_3:#010x})"
+
     def next(self):
         """Generate the next random number"""
         temp = self.seed_0 ^ self.seed_0 << 11 & 0xFFFFFFFF
@@ -26,16 +257,31 @@ class Xorshift:
         temp ^= temp << 11 & 0xFFFFFFFF
         temp ^= temp << 22 & 0xFFFFFFFF
 
-        self.seed_0 = temp
-        self.seed_1 = self.seed_0
-        self.seed_2 = self.seed_1
         self.seed_3 = self.seed_2
+        self.seed_2 = self.seed_1
+        self.seed_1 = self.seed_0
+        self.seed_0 = temp
 
         return self.seed_3
 
     def advance(self,length:int):
-        """Skip advances of length"""
-        self.get_next_rand_sequence(length)
+        """Skip advances of length, negative lengths rewind"""
+        if length<0:
+            self.rewind(-length)
+            return
+        if length<JUMP_THRESHOLD:
+            for _ in range(length):
+                self.next()
+            return
+        self.set_int(jump_ahead(self.to_int(),length))
+
+    def rewind(self,length:int):
+        """Undo advances of length"""
+        if length<JUMP_THRESHOLD:
+            for _ in range(length):
+                self.prev()
+            return
+        self.set_int(jump_ahead(self.to_int(),-length))
 
     def range(self,minimum:int,maximum:int)->int:
         """Generate random integer in range [minimum,maximum)
@@ -72,11 +318,141 @@ class Xorshift:
 
     def get_next_rand_sequence(self,length):
         """Generate a the next random sequence of length"""
-        return [self.next() for _ in range(length)]
+        if length<LANE_THRESHOLD:
+            return [self.next() for _ in range(length)]
+        return self.get_next_rand_block(length).tolist()
+
+    def get_next_rand_block(self,length)->np.ndarray:
+        """Generate the next random sequence of length as a uint32 array
+
+        The range is split into lanes placed by jumping ahead
+        and every lane is stepped at once
+        """
+        if length<LANE_THRESHOLD:
+            return np.array(self.get_next_rand_sequence(length),dtype=np.uint32)
+        lanes = _lane_count(length)
+        lane_length = -(-length//lanes)
+        block = np.empty((lane_length+4,lanes),dtype=np.uint32)
+        block[:4] = _lane_seeds(self.to_int(),lanes,lane_length)
+        _fill_next_rows(block)
+        self.advance(length)
+        return block[4:].T.reshape(-1)[:length]
+
+    def iter_next(self,length:int=None)->Iterator[int]:
+        """Lazily generate the next random numbers, endlessly if length is None
+
+        Values are generated in blocks of ITER_CHUNK, any generated but not consumed
+        are stepped back over when the iterator is exhausted or closed
+        """
+        unconsumed = 0
+        try:
+            for chunk in self.iter_chunks(ITER_CHUNK,length):
+                unconsumed = len(chunk)
+                for rand in chunk.tolist():
+                    unconsumed -= 1
+                    yield rand
+        finally:
+            self.rewind(unconsumed)
+
+    def iter_chunks(self,chunk_size:int,length:int=None)->Iterator[np.ndarray]:
+        """Lazily generate the next random numbers as uint32 blocks of chunk_size,
+           endlessly if length is None
+
+        The final block is shorter when length is not a multiple of chunk_size
+        """
+        while length is None or length>0:
+            size = chunk_size if length is None else min(chunk_size,length)
+            yield self.get_next_rand_block(size)
+            if length is not None:
+                length -= size
+
+    def values_at(self,indices)->Tuple[np.ndarray,np.ndarray]:
+        """Get the outputs and states at arbitrary advance indices without moving the rng
+
+        Index i is the output get_next_rand_sequence would return at position i
+        and its state is the one right after generating it.
+        Sorted indices are reached by jumping or stepping from the previous one
+
+        Returns:
+            rands:np.ndarray of uint32, states:np.ndarray of uint32 with shape (len(indices),4)
+        """
+        indices = np.asarray(indices,dtype=np.int64).reshape(-1)
+        rands = np.empty(len(indices),dtype=np.uint32)
+        states = np.empty((len(indices),4),dtype=np.uint32)
+        cursor = self.copy()
+        position = -1
+        for i in np.argsort(indices,kind="stable").tolist():
+            index = int(indices[i])
+            cursor.advance(index-position)
+            position = index
+            states[i] = cursor.get_state()
+            rands[i] = cursor.seed_3
+        return rands, states
+
+    def distance_to(self,other:"Xorshift",max_distance:int=1<<40)->int:
+        """Count the advances from this state to other with a baby-step giant-step search
+
+        Baby steps are the states after advancing 0 to baby-1 times, keyed by seed_2 and
+        seed_3. Giant steps rewind other by multiples of baby, many lanes at a time
+
+        Args:
+            other (Xorshift): state reached from this one
+            max_distance (int, optional): largest distance searched. Defaults to 2**40.
+
+        Returns:
+            int: advances from this state to other, None if not reachable within max_distance
+        """
+        baby = max(1,min(MAX_BABY_STEPS,int((max_distance+1)**0.5)+1))
+        # the state after j advances is words[j:j+4]
+        words = np.concatenate([np.array(self.get_state(),dtype=np.uint32),
+                                self.copy().get_next_rand_block(baby-1)])
+        keys = words[2:baby+2].astype(np.uint64) << np.uint64(32) | words[3:baby+3]
+        order = np.argsort(keys,kind="stable")
+        sorted_keys = keys[order]
+
+        giants = -(-(max_distance+1)//baby)
+        lanes = min(giants,MAX_GIANT_LANES)
+        lane_steps = -(-giants//lanes)
+        seeds = _lane_seeds(other.to_int(),lanes,-baby*lane_steps)
+        columns = _stride_columns(-baby)
+        for step in range(lane_steps):
+            lane_keys = seeds[2].astype(np.uint64) << np.uint64(32) | seeds[3]
+            found = np.searchsorted(sorted_keys,lane_keys)
+            found[found==baby] = 0
+            for lane in np.nonzero(sorted_keys[found]==lane_keys)[0].tolist():
+                position = int(found[lane])
+                while position<baby and sorted_keys[position]==lane_keys[lane]:
+                    j = int(order[position])
+                    if words[j]==seeds[0,lane] and words[j+1]==seeds[1,lane]:
+                        distance = (lane*lane_steps+step)*baby+j
+                        # states are unique well within the period, so the first match is it
+                        return distance if distance<=max_distance else None
+                    position += 1
+            seeds = _apply_columns_lanes(columns,seeds)
+        return None
 
     def get_prev_rand_sequence(self,length):
         """Generate the previous random sequence of length"""
-        return [self.prev() for _ in range(length)]
+        if length<LANE_THRESHOLD:
+            return [self.prev() for _ in range(length)]
+        return self.get_prev_rand_block(length).tolist()
+
+    def get_prev_rand_block(self,length)->np.ndarray:
+        """Generate the previous random sequence of length as a uint32 array
+
+        The range is split into lanes placed by jumping backwards
+        and every lane is stepped back at once
+        """
+        if length<LANE_THRESHOLD:
+            return np.array(self.get_prev_rand_sequence(length),dtype=np.uint32)
+        lanes = _lane_count(length)
+        lane_length = -(-length//lanes)
+        block = np.empty((lane_length+4,lanes),dtype=np.uint32)
+        block[3::-1] = _lane_seeds(self.to_int(),lanes,-lane_length)
+        _fill_prev_rows(block)
+        self.rewind(length)
+        # the output of each step back is the seed_3 it leaves behind
+        return block[1:lane_length+1].T.reshape(-1)[:length]
 
     def get_state(self):
         """Get the state of the RNG"""
@@ -88,3 +464,124 @@ class Xorshift:
         self.seed_1 = seed_1
         self.seed_2 = seed_2
         self.seed_3 = seed_3
+
+class XorshiftLanes:
+    """Many independent Xorshift Random Number Generators stepped together
+
+    Each seed is a uint32 array holding that word for every lane
+    """
+    __slots__ = ("seed_0","seed_1","seed_2","seed_3")
+
+    def __init__(self,seed_0,seed_1,seed_2,seed_3):
+        self.seed_0 = np.array(seed_0,dtype=np.uint32)
+        self.seed_1 = np.array(seed_1,dtype=np.uint32)
+        self.seed_2 = np.array(seed_2,dtype=np.uint32)
+        self.seed_3 = np.array(seed_3,dtype=np.uint32)
+
+    @classmethod
+    def from_states(cls,states)->"XorshiftLanes":
+        """Create lanes from a list of [seed_0,seed_1,seed_2,seed_3] states"""
+        return cls(*np.array(states,dtype=np.uint32).reshape(-1,4).T)
+
+    def __len__(self):
+        return len(self.seed_0)
+
+    def next(self)->np.ndarray:
+        """Generate the next random number of every lane"""
+        temp = self.seed_0 ^ self.seed_0 << 11
+        self.seed_0 = self.seed_1
+        self.seed_1 = self.seed_2
+        self.seed_2 = self.seed_3
+        self.seed_3 = temp ^ temp >> 8 ^ self.seed_3 ^ self.seed_3 >> 19
+
+        return self.seed_3
+
+    def prev(self)->np.ndarray:
+        """Generate the previous random number of every lane"""
+        temp = self.seed_2 >> 19 ^ self.seed_2 ^ self.seed_3
+        temp ^= temp >> 8
+        temp ^= temp >> 16
+
+        temp ^= temp << 11
+        temp ^= temp << 22
+
+        self.seed_3 = self.seed_2
+        self.seed_2 = self.seed_1
+        self.seed_1 = self.seed_0
+        self.seed_0 = temp
+
+        return self.seed_3
+
+    def advance(self,length:int):
+        """Skip advances of length in every lane, negative lengths rewind"""
+        if abs(length)<JUMP_THRESHOLD:
+            for _ in range(length):
+                self.next()
+            for _ in range(-length):
+                self.prev()
+            return
+        self.set_state(*_apply_columns_lanes(_stride_columns(length),self.get_state()))
+
+    def rewind(self,length:int):
+        """Undo advances of length in every lane"""
+        self.advance(-length)
+
+    def jump(self,lengths):
+        """Skip a different amount of advances in each lane, negative lengths rewind"""
+        lengths = np.broadcast_to(np.asarray(lengths,dtype=np.int64),(len(self),))
+        seeds = self.get_state()
+        for table,distance in ((_forward_table(),np.maximum(lengths,0)),
+                               (_backward_table(),np.maximum(-lengths,0))):
+            k = 0
+            while distance.any():
+                selected = distance&1==1
+                if selected.any():
+                    seeds[:,selected] = table.apply_lanes(k,seeds[:,selected])
+                distance = distance>>1
+                k += 1
+        self.set_state(*seeds)
+
+    def range(self,minimum:int,maximum:int)->np.ndarray:
+        """Generate random integers in range [minimum,maximum) for every lane"""
+        return self.next() % np.uint32(maximum-minimum) + minimum
+
+    def randfloat(self)->np.ndarray:
+        """Generate random floats in range [0,1] for every lane"""
+        return kernels.randfloat(self.next())
+
+    def rangefloat(self,minimum:float,maximum:float)->np.ndarray:
+        """Generate random floats in range [minimum,maximum] for every lane"""
+        return kernels.rangefloat(self.next(),minimum,maximum)
+
+    def get_next_rand_block(self,length)->np.ndarray:
+        """Generate the next random sequence of length for every lane
+           as a (length,lanes) uint32 array"""
+        block = np.empty((length+4,len(self)),dtype=np.uint32)
+        block[:4] = self.get_state()
+        _fill_next_rows(block)
+        self.set_state(*block[-4:])
+        return block[4:]
+
+    def get_prev_rand_block(self,length)->np.ndarray:
+        """Generate the previous random sequence of length for every lane
+           as a (length,lanes) uint32 array"""
+        block = np.empty((length+4,len(self)),dtype=np.uint32)
+        block[3::-1] = self.get_state()
+        _fill_prev_rows(block)
+        self.set_state(*block[-1:-5:-1])
+        return block[1:length+1]
+
+    def get_lane(self,index:int)->Xorshift:
+        """Get a single lane as a Xorshift"""
+        return Xorshift(*[int(seed[index]) for seed in self.get_state()])
+
+    def get_state(self)->np.ndarray:
+        """Get the state of every lane as a (4,lanes) uint32 array"""
+        return np.stack([self.seed_0, self.seed_1, self.seed_2, self.seed_3])
+
+    def set_state(self, seed_0, seed_1, seed_2, seed_3):
+        """Set state of every lane"""
+        self.seed_0 = np.array(seed_0,dtype=np.uint32)
+        self.seed_1 = np.array(seed_1,dtype=np.uint32)
+        self.seed_2 = np.array(seed_2,dtype=np.uint32)
+        self.seed_3 = np.array(seed_3,dtype=np.uint32)